@@ -3,23 +3,38 @@ from __future__ import annotations
 import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 
+import queue
+import threading
 import pygame
 import bisect
+import argparse
 import webbrowser
 
 import modules.ig as ig
 import modules.rgb as rgb
 
+from array import array
 from urllib.parse import urlparse
 from modules.gui import Scene, TextBox, Button, Rect, TextPos
-from modules.ig import InstagramDir, Target, InvalidInstagramDir
-from modules.utils import Unreachable, State, ErrorType, Method, get_uuid_if_needed
+from modules.ig import InstagramDir, Target, InvalidInstagramDir, DirNotFound, Connections, NO_TIMESTAMP
+from modules.watcher import FolderWatcher
+from modules.views import DiffView, OrderedView, AnnotatedView
+from modules.external import OutOfCore, RunView
+from modules.server import QueryService, QueryServer
+from modules.cohorts import get_cohorts
+from modules.query import InvalidQuery
+from modules.parallel import get_diff
+from modules.archive import ArchivedDir, InvalidArchive, ARCHIVE_EXTENSION, save_archives, open_archive, find_archives
+from modules.cache import cache_dir
+from modules.session import Session, InvalidSession, save_session, load_session, restore_dirs, revalidate_in_background
+from modules.utils import Unreachable, State, ErrorType, Method, Order, get_dir_label
 
 state = State()
 
 FPS = 60
 SIZE = (1280, 720)
 ERRORLIFETIME = 5 * FPS
+IDLE_AFTER_MS = 250
 CAPTION = "lcmp | Inspect your instagram's followers & following (github.com/mblucasm/lcmp)"
 LOGO_PATH = "assets/logo.svg"
 
@@ -46,7 +61,7 @@ MAIN_SCENE = Scene(
         "dir-list": Button(
             rect = Rect(0, 0, 0.2, 1),
             text = "",
-            size = 30,
+            size = 20,
             rectcolor = rgb.LIGHT_GRAY,
             scrollbarcolor = rgb.WHITE,
             isscrollable = True,
@@ -67,6 +82,22 @@ MAIN_SCENE = Scene(
             textpos = TextPos.CENTERED,
             isvisible = False,
         ),
+        "switch-order": Button(
+            rect = Rect(0.91, 0.5, 0.08, 0.09),
+            text = "",
+            size = 15,
+            rectcolor = rgb.GARNET,
+            textpos = TextPos.CENTERED,
+            isvisible = False,
+        ),
+        "cohorts": Button(
+            rect = Rect(0.91, 0.4, 0.08, 0.09),
+            text = "Click to see retention",
+            size = 15,
+            rectcolor = rgb.DARK_GREEN,
+            textpos = TextPos.CENTERED,
+            isvisible = False,
+        ),
         "switch-method": Button(
             rect = Rect(0.91, 0.7, 0.08, 0.09),
             text = "Click to switch method",
@@ -101,6 +132,35 @@ MAIN_SCENE = Scene(
     },
 )
 
+COHORTS_SCENE = Scene(
+    buttons = {
+        "back": Button(
+            rect = Rect(0, 0, 0.1, 0.1),
+            text = "Back",
+            size = 30,
+            rectcolor = rgb.LIGHT_GRAY,
+            textpos = TextPos.CENTERED,
+        ),
+    },
+    textboxes = {
+        "title": TextBox(
+            rect = Rect(0.1, 0, 0.9, 0.1),
+            text = "",
+            size = 30,
+            rectcolor = rgb.WHITE,
+            textcolor = rgb.BLACK,
+            textpos = TextPos.CENTERED,
+        ),
+        "table": TextBox(
+            rect = Rect(0, 0.1, 1, 0.9),
+            text = "",
+            size = 20,
+            scrollbarcolor = rgb.WHITE,
+            isscrollable = True,
+        ),
+    },
+)
+
 def create_new_error(etype: ErrorType, msg: str) -> None:
 
     global state
@@ -154,25 +214,36 @@ def mainscene_update_visuals() -> None:
     assert state.scenes[state.scenename].buttons.get("user-list") is not None
     assert state.scenes[state.scenename].buttons.get("switch-target") is not None
     assert state.scenes[state.scenename].buttons.get("switch-method") is not None
+    assert state.scenes[state.scenename].buttons.get("switch-order") is not None
+    assert state.scenes[state.scenename].buttons.get("cohorts") is not None
     assert state.scenes[state.scenename].textboxes.get("phrases") is not None
     assert state.scenes[state.scenename].textboxes.get("n-selections") is not None
     assert state.scenes[state.scenename].textboxes.get("n-users-displayed") is not None
 
     nos = int(state.selected[0] is not None) + int(state.selected[1] is not None)
 
-    if state.selected[0] is None:
+    if state.selected[0] is None and state.query is None:
         state.scenes[state.scenename].buttons["user-list"].isvisible = False
         state.scenes[state.scenename].textboxes["n-users-displayed"].isvisible = False
     else:
         state.scenes[state.scenename].buttons["user-list"].isvisible = True
-        state.scenes[state.scenename].buttons["user-list"].text = "\n".join(user for user in state.users.keys())
+        state.scenes[state.scenename].buttons["user-list"].parrs = [] if state.users is None else state.users
         state.scenes[state.scenename].textboxes["n-users-displayed"].isvisible = True
-        state.scenes[state.scenename].textboxes["n-users-displayed"].text = f"Displaying {len(state.users)} users"
+        state.scenes[state.scenename].textboxes["n-users-displayed"].text = f"Displaying {0 if state.users is None else len(state.users)} users"
 
     state.scenes[state.scenename].buttons["switch-target"].isvisible = state.selected[0] is not None and state.selected[1] is not None
     state.scenes[state.scenename].buttons["switch-method"].isvisible = state.selected[0] is not None
+    state.scenes[state.scenename].buttons["switch-order"].isvisible = state.selected[0] is not None and state.outofcore is None and state.query is None
+    state.scenes[state.scenename].buttons["switch-order"].text = get_order_phrase()
+    state.scenes[state.scenename].buttons["cohorts"].isvisible = state.selected[0] is not None and state.outofcore is None
     state.scenes[state.scenename].textboxes["n-selections"].text = f"Number of selections: {nos}"
-    state.scenes[state.scenename].textboxes["phrases"].text = get_phrase()
+
+    if state.typing is not None:
+        state.scenes[state.scenename].textboxes["phrases"].text = f"/{state.typing}_"
+    elif state.query is not None:
+        state.scenes[state.scenename].textboxes["phrases"].text = f"Query: {state.query}"
+    else:
+        state.scenes[state.scenename].textboxes["phrases"].text = get_phrase()
 
 def mainscene_switch_method(_) -> None:
 
@@ -183,6 +254,85 @@ def mainscene_switch_method(_) -> None:
     state_update_users()
     mainscene_update_visuals()
 
+def mainscene_switch_order(_) -> None:
+
+    global state
+    assert state.scenename == "main"
+
+    state.order = state.order.next()
+    state_apply_order()
+    mainscene_update_visuals()
+
+def mainscene_start_query() -> None:
+
+    global state
+    assert state.scenename == "main"
+
+    # Expressions combine whole lists in memory, which is what --memory-budget avoids
+    if state.outofcore is not None:
+        create_new_error(ErrorType.WARNING, "Expressions can't be used with --memory-budget, they need the whole lists in memory")
+        return
+
+    state.typing = ""
+    mainscene_update_visuals()
+
+def mainscene_cancel_query() -> None:
+
+    global state
+    assert state.scenename == "main"
+
+    state.typing = None
+    mainscene_update_visuals()
+
+def mainscene_run_query() -> None:
+
+    global state
+    assert state.scenename == "main"
+    assert state.typing is not None
+
+    try:
+        result = state.queries.run(state.typing, state.dirs)
+    except (InvalidQuery, DirNotFound) as e:
+        create_new_error(ErrorType.ERROR, e.args[0])
+        return
+    except FileNotFoundError as e:
+        create_new_error(ErrorType.ERROR, f"Couldn't find {e.filename}. You probably renamed, moved or deleted some files")
+        return
+
+    state_drop_diff()
+
+    state.query = state.typing
+    state.typing = None
+    state.diff = state.users = result
+    mainscene_update_visuals()
+
+def mainscene_open_cohorts(_) -> None:
+
+    global state
+    assert state.scenename == "main"
+    assert state.selected[0] is not None
+    assert state.outofcore is None
+
+    username = state.dirs[state.selected[0]].username
+
+    try:
+        cohorts = get_cohorts(state.dirs, username, state.cache.get)
+    except FileNotFoundError as e:
+        create_new_error(ErrorType.ERROR, f"Couldn't find {e.filename}. You probably renamed, moved or deleted some files")
+        return
+
+    state.scenename = "cohorts"
+    state.scenes[state.scenename].textboxes["title"].text = f"Follower retention of {username} across {len(cohorts)} exports"
+    state.scenes[state.scenename].textboxes["table"].parrs = cohorts.table() if len(cohorts) > 1 else ["Load at least two exports of this account to see how its followers are retained"]
+
+def cohortsscene_back(_) -> None:
+
+    global state
+    assert state.scenename == "cohorts"
+
+    state.scenename = "main"
+    mainscene_update_visuals()
+
 def mainscene_switch_target(_) -> None:
 
     assert len(Target) == 2
@@ -194,42 +344,184 @@ def mainscene_switch_target(_) -> None:
     state_update_users()
     mainscene_update_visuals()
 
+# What's displayed lets go of what it reads: the parses it holds, or its result file on disk
+def state_drop_diff() -> None:
+
+    global state
+
+    if isinstance(state.diff, RunView):
+        state.diff.remove()
+    elif state.diff is not None:
+        state.diff.release()
+
+    state.diff = None
+    state.users = None
+
 def state_update_users() -> None:
 
     global state
 
+    state_drop_diff()
+
+    # Selections replace whatever query was displayed
+    state.query = None
+
     if state.selected[0] is None:
-        state.users.clear()
+        state.diff = None
+        state.users = None
         return
 
     as_target = Target.FOLLOWERS if (state.selected[1] is None) or (state.target == Target.FOLLOWERS) else Target.FOLLOWING
     bs_target = Target.FOLLOWING if (state.selected[1] is None) or (state.target == Target.FOLLOWING) else Target.FOLLOWERS
 
+    adir = state.dirs[state.selected[0]]
+    bdir = state.dirs[state.selected[0] if state.selected[1] is None else state.selected[1]]
+
     try:
-        a = ig.extract_from(state.dirs[state.selected[0]].path, as_target)
-        b = ig.extract_from(state.dirs[state.selected[0] if state.selected[1] is None else state.selected[1]].path, bs_target)
+        if state.outofcore is not None:
+            state.diff = state.users = state.outofcore.diff(adir, as_target, bdir, bs_target, state.method)
+            return
+        a, b = state.cache.acquire_all([(adir, as_target), (bdir, bs_target)])
 
     except FileNotFoundError as e:
         # TODO: Maybe don't delete users selections, refigure them out
         state.selected = (None, None)
-        state.users.clear()
+        state.diff = None
+        state.users = None
         create_new_error(ErrorType.ERROR, f"Couldn't find {e.filename}. You probably renamed, moved or deleted some files. Restart lcmp and reload the folders if you want to select this one")
         return
 
-    as_users = a.keys()
-    bs_users = b.keys()
+    except InvalidInstagramDir as e:
+        state.selected = (None, None)
+        state.diff = None
+        state.users = None
+        create_new_error(ErrorType.ERROR, e.args[0])
+        return
+
+    state.diff = get_diff(state.cache, a, b, state.method)
+    state_apply_order()
 
-    if state.method == Method.XA:
-        extracted_users = sorted(set(bs_users) - set(as_users))
-    elif state.method == Method.AX:
-        extracted_users = sorted(set(as_users) - set(bs_users))
-    elif state.method == Method.AA:
-        extracted_users = sorted(set(as_users) & set(bs_users))
+# The sort keys live with each parsed export, so switching order only filters a cached permutation
+def get_permutation(order: Order, walker: Connections) -> array[int]:
+
+    global state
+    assert len(Order) == 4
+    assert state.selected[0] is not None
+
+    if order == Order.RECENT:
+        return walker.permutation("recent", 0, lambda i: (walker.stamps[i] == NO_TIMESTAMP, -walker.stamps[i], i))
+
+    if order == Order.SNAPSHOTS:
+        version = state.index.version
+        counts = state.index.nsnapshots(walker.usernames)
+        return walker.permutation("snapshots", version, lambda i: (-counts[i], i))
+
+    if order == Order.FOLLOW_BACK:
+        # Mutuals first, then people who only follow the first selected folder, then people it only follows
+        folder = state.dirs[state.selected[0]]
+        followers = state.cache.get(folder, Target.FOLLOWERS)
+        following = state.cache.get(folder, Target.FOLLOWING)
+        def key(i: int) -> tuple[int, int]:
+            isfollower = walker.usernames[i] in followers
+            isfollowing = walker.usernames[i] in following
+            return (0 if isfollower and isfollowing else 1 if isfollower else 2 if isfollowing else 3), i
+        return walker.permutation(f"follow-back-{folder.fingerprint}", 0, key)
+
+    raise Unreachable()
+
+def state_apply_order() -> None:
+
+    global state
+
+    if state.diff is None:
+        state.users = None
+    elif state.order == Order.ALPHABETICAL or not isinstance(state.diff, DiffView):
+        state.users = state.diff
     else:
-        raise Unreachable
+        try:
+            state.users = state.diff.ordered(state.order.name, get_permutation(state.order, state.diff.walker))
+        except FileNotFoundError as e:
+            state.users = state.diff
+            create_new_error(ErrorType.ERROR, f"Couldn't find {e.filename}. Showing the users alphabetically")
+
+    if isinstance(state.diff, DiffView) and isinstance(state.users, (DiffView, OrderedView)):
+        try:
+            state_annotate_users(state.diff)
+        except FileNotFoundError as e:
+            create_new_error(ErrorType.ERROR, f"Couldn't find {e.filename}. Showing the users without their relations")
+        except InvalidInstagramDir as e:
+            create_new_error(ErrorType.ERROR, f"{e.args[0]}. Showing the users without their relations")
+
+def get_relations_wanted() -> tuple[InstagramDir, InstagramDir | None, list[tuple[InstagramDir, Target]]]:
+
+    global state
+    assert state.selected[0] is not None
+
+    a = state.dirs[state.selected[0]]
+    b = None if state.selected[1] is None else state.dirs[state.selected[1]]
+    you, other = (b, a) if b is not None and b.username == a.username else (a, b)
+
+    return you, other, [(you, Target.FOLLOWERS), (you, Target.FOLLOWING)] + ([] if other is None else [(other, target) for target in Target])
+
+# Flags every row with whether it follows and is followed by the account, and whether it's in the other selected export
+# With two exports of the same account its latest one tells what the relations are now
+# Up to four more parses, never done on the UI thread: the rows are shown without their relations until they're parsed
+def state_annotate_users(diff: DiffView) -> None:
+
+    global state
+
+    wanted = get_relations_wanted()[2]
+
+    if all(state.cache.has(instagram_dir, target) for instagram_dir, target in wanted):
+        state_apply_relations(diff, state.cache.acquire_all(wanted))
+        return
+
+    def run() -> None:
+        try:
+            state.annotated.put((diff, state.cache.acquire_all(wanted)))
+        except (OSError, InvalidInstagramDir) as e:
+            state.annotated.put((diff, e))
 
-    merged = a | b
-    state.users = {k: merged[k] for k in extracted_users}
+    threading.Thread(target = run, name = "lcmp-annotate", daemon = True).start()
+
+def state_apply_relations(diff: DiffView, held: list[Connections]) -> None:
+
+    global state
+
+    # Whatever was displayed since is left alone, and the parses fetched for it are let go
+    if diff is not state.diff or state.selected[0] is None:
+        for connections in held:
+            connections.release()
+        return
+
+    users = state.users.view if isinstance(state.users, AnnotatedView) else state.users
+    assert isinstance(users, (DiffView, OrderedView))
+
+    you, other, _ = get_relations_wanted()
+    followers, following, *others = held
+    relations = diff.relations(followers, following, others)
+    state.users = AnnotatedView(users, relations, you.username, None if other is None else f"{other.username} {other.date.str}")
+
+def handle_annotated_events() -> None:
+
+    global state
+
+    while True:
+        try:
+            diff, result = state.annotated.get_nowait()
+        except queue.Empty:
+            break
+
+        if isinstance(result, list):
+            state_apply_relations(diff, result)
+            if diff is state.diff and state.scenename == "main":
+                mainscene_update_visuals()
+        elif diff is state.diff and isinstance(result, FileNotFoundError):
+            create_new_error(ErrorType.ERROR, f"Couldn't find {result.filename}. Showing the users without their relations")
+        elif diff is state.diff and isinstance(result, InvalidInstagramDir):
+            create_new_error(ErrorType.ERROR, f"{result.args[0]}. Showing the users without their relations")
+        elif diff is state.diff:
+            create_new_error(ErrorType.ERROR, f"Couldn't read the relations of these users\n{result}")
 
 def state_update_selected(listidx: int) -> None:
 
@@ -253,6 +545,28 @@ def mainscene_click_folder(i: int, button: Button) -> None:
     state_update_selected(button.start + i)
     state_update_users()
     mainscene_update_visuals()
+    state_prefetch_around(button.start + i)
+
+# The next click is most likely the other target or an export of the same account right before or after this one
+def state_prefetch_around(listidx: int) -> None:
+
+    global state
+
+    if state.outofcore is not None or not 0 <= listidx < len(state.dirs):
+        return
+
+    username = state.dirs[listidx].username
+    around = [listidx]
+
+    for step in (1, -1):
+        j = listidx + step
+        while 0 <= j < len(state.dirs) and state.dirs[j].username != username:
+            j += step
+        if 0 <= j < len(state.dirs):
+            around.append(j)
+
+    around += [j for j in (listidx + 1, listidx - 1) if 0 <= j < len(state.dirs) and j not in around]
+    state.cache.prefetch([(state.dirs[j], target) for j in around for target in Target])
 
 def mainscene_click_user(i: int, button: Button) -> None:
 
@@ -260,10 +574,45 @@ def mainscene_click_user(i: int, button: Button) -> None:
     assert state.scenename == "main"
     assert state.scenes[state.scenename].buttons.get("user-list") is not None
 
-    username = state.scenes[state.scenename].buttons["user-list"].text.split("\n")[button.start + i]
-    if username != "" and (url := state.users[username]):
+    if state.users is None or button.start + i >= len(state.users):
+        return
+
+    if url := state.users.url(button.start + i):
         if issafeurl(url):
-            webbrowser.open(state.users[username])
+            webbrowser.open(url)
+
+def mainscene_history_user(i: int, button: Button) -> None:
+
+    global state
+    assert state.scenename == "main"
+
+    # Rows may be followed by their relations, usernames never have spaces
+    username = button.get_parr(button.start + i).split(' ', 1)[0]
+    if username == "":
+        return
+
+    history = state.index.history(username)
+    if len(history) == 0:
+        create_new_error(ErrorType.INFO, f"{username} wasn't found in the parsed folders yet")
+        return
+
+    places = [f"{folder.username} {folder.date.str} {target.name.lower()}" for folder, target in history]
+    create_new_error(ErrorType.INFO, f"{username} appears in {len(places)} lists: " + ", ".join(places))
+
+def get_order_phrase() -> str:
+
+    global state
+    assert len(Order) == 4
+
+    if state.order == Order.ALPHABETICAL:
+        return "Sorted alphabetically"
+    if state.order == Order.RECENT:
+        return "Sorted by most recent follow"
+    if state.order == Order.SNAPSHOTS:
+        return "Sorted by number of lists"
+    if state.order == Order.FOLLOW_BACK:
+        return "Sorted by follow back"
+    raise Unreachable()
 
 # TODO: Refactor this
 def get_phrase() -> str:
@@ -373,46 +722,299 @@ def get_phrase() -> str:
 
     raise Unreachable()
 
-def handle_dropfile(path: str) -> None:
+def state_insert_dir(newdir: InstagramDir) -> bool:
 
     global state
+    assert state.scenes["main"].buttons.get("dir-list") is not None
 
-    try:
-        newdir = InstagramDir(path)
-    except InvalidInstagramDir as e:
-        create_new_error(ErrorType.ERROR, e.args[0])
-        return
+    if newdir in state.dirs:
+        return False
+
+    if (duplicate := state.fingerprints.get(newdir.fingerprint)) is not None:
+        create_new_error(ErrorType.INFO, f"{os.path.basename(newdir.path)} wasn't added, it holds the same data as {duplicate.username} {duplicate.date.str} ({duplicate.uuid})")
+        return False
 
-    if newdir not in state.dirs:
+    state.fingerprints[newdir.fingerprint] = newdir
+    # With a budget only what's likely to be selected next is parsed ahead, see state_prefetch_around
+    # Archived snapshots are only rebuilt when they're selected, keeping all of them in memory is what archiving avoids
+    if state.outofcore is None and state.cache.budget is None and newdir.isfolder:
+        state.cache.load_in_background(newdir)
 
-        state.scenename = "main"
-        assert state.scenes[state.scenename].buttons["dir-list"] is not None
+    i = bisect.bisect_right(state.dirs, newdir.date, key = lambda x: x.date)
+    state.dirs.insert(i, newdir)
 
-        bisect.insort(state.dirs, newdir, key = lambda x: x.date)
-        state.scenes[state.scenename].buttons["dir-list"].text = f"> {state.dirs[0].username} {state.dirs[0].date.str} {get_uuid_if_needed(0, state.dirs)}"
+    # Whether a folder shows its uuid only depends on its neighbours, so only they can change
+    button = state.scenes["main"].buttons["dir-list"]
+    if len(state.dirs) == 1:
+        button.text = get_dir_label(0, state.dirs)
+    else:
+        button.insert_parr(i, get_dir_label(i, state.dirs))
+    for j in (i - 1, i + 1):
+        if 0 <= j < len(state.dirs):
+            button.set_parr(j, get_dir_label(j, state.dirs))
+
+    # The next export of the same account is now compared against this one
+    after = next((j for j in range(i + 1, len(state.dirs)) if state.dirs[j].username == newdir.username), None)
+    if after is not None and after != i + 1:
+        button.set_parr(after, get_dir_label(after, state.dirs))
+
+    state.summaries.put(newdir)
+
+    # Selections after the new folder are shifted so they keep pointing at the same folders
+    s0, s1 = state.selected
+    state.selected = (None if s0 is None else s0 + int(s0 >= i), None if s1 is None else s1 + int(s1 >= i))
 
-        for i, folder in enumerate(state.dirs[1:], 1):
-            state.scenes[state.scenename].buttons["dir-list"].text += f"\n> {folder.username} {folder.date.str} {get_uuid_if_needed(i, state.dirs)}"
+    return True
+
+# Every snapshot of the archives is shown like a folder. Returns whether any was new
+def state_open_archives(paths: list[str], errortype: ErrorType) -> bool:
+
+    global state
+
+    if len(paths) == 0:
+        return False
+
+    if state.outofcore is not None:
+        create_new_error(errortype, "Archives are read into memory, they can't be opened with --memory-budget")
+        return False
+
+    errors: list[str] = []
+    inserted = False
+
+    for path in paths:
+        try:
+            snapshots = open_archive(path)
+        except (OSError, InvalidArchive) as e:
+            errors.append(f"Couldn't open {path}\n{e}" if isinstance(e, OSError) else e.args[0])
+            continue
+        for snapshot in snapshots:
+            inserted = state_insert_dir(snapshot) or inserted
+
+    if len(errors) == 1:
+        create_new_error(errortype, errors[0])
+    elif len(errors) > 1:
+        create_new_error(errortype, f"{len(errors)} archives couldn't be opened. First one:\n{errors[0]}")
+
+    return inserted
+
+def handle_dropfiles(paths: list[str]) -> None:
+
+    global state
+
+    archives = [path for path in paths if path.endswith(ARCHIVE_EXTENSION)]
+    folders = [path for path in paths if not path.endswith(ARCHIVE_EXTENSION)]
+
+    results = ig.validate_many(folders, known = state.summaries.get) if len(folders) > 0 else []
+    errors = [result for result in results if isinstance(result, InvalidInstagramDir)]
+
+    if len(errors) == 1:
+        create_new_error(ErrorType.ERROR, errors[0].args[0])
+    elif len(errors) > 1:
+        create_new_error(ErrorType.ERROR, f"{len(errors)} folders couldn't be loaded. First one:\n{errors[0].args[0]}")
+
+    inserted = state_open_archives(archives, ErrorType.ERROR)
+    for result in results:
+        if isinstance(result, InstagramDir):
+            inserted = state_insert_dir(result) or inserted
+
+    if inserted:
+
+        # The first folders leave the welcome scene, any other scene stays and the main one is updated when it's back
+        if state.scenename == "welcome":
+            state.scenename = "main"
 
         # TODO: Maybe don't delete users selections, refigure them out
         state.selected = (None, None)
         state_update_users()
-        mainscene_update_visuals()
+        if state.scenename == "main":
+            mainscene_update_visuals()
+
+def handle_loaded_events(events: queue.Queue[InstagramDir | InvalidInstagramDir], origin: str) -> None:
+
+    global state
+
+    inserted = False
+
+    while True:
+        try:
+            event = events.get_nowait()
+        except queue.Empty:
+            break
+
+        if isinstance(event, InvalidInstagramDir):
+            create_new_error(ErrorType.ERROR, event.args[0])
+        elif state_insert_dir(event):
+            create_new_error(ErrorType.INFO, f"Loaded {event.username} {event.date.str} {origin}")
+            inserted = True
+
+    if inserted:
+        if state.scenename == "welcome":
+            state.scenename = "main"
+        if state.scenename == "main":
+            mainscene_update_visuals()
+
+def handle_watcher_events() -> None:
+
+    global state
+
+    if state.watcher is None:
+        return
+
+    handle_loaded_events(state.watcher.events, "from watched folder")
+
+def state_save_session() -> None:
+
+    global state
+
+    # Archived snapshots come back by opening their archive again
+    dirs = [folder.archivepath if isinstance(folder, ArchivedDir) else folder.path for folder in state.dirs]
+
+    session = Session(
+        dirs = list(dict.fromkeys(dirs)),
+        selected = (None if state.selected[0] is None else state.dirs[state.selected[0]].path, None if state.selected[1] is None else state.dirs[state.selected[1]].path),
+        method = state.method.name,
+        target = state.target.name,
+        order = state.order.name,
+        scroll = {name: state.scenes["main"].buttons[name].start for name in ("dir-list", "user-list")},
+    )
+
+    try:
+        save_session(session)
+        state.summaries.save()
+        if state.cache.store is not None:
+            state.cache.persist(state.dirs)
+        if state.outofcore is not None:
+            state.outofcore.prune(state.dirs)
+    except OSError:
+        ...
+
+# Folders come back from their saved fingerprints and their parses are mapped from the store when needed,
+# so nothing is read up front. The ones whose files changed are loaded again in the background
+def state_restore_session() -> None:
+
+    global state
+
+    try:
+        session = load_session()
+    except InvalidSession as e:
+        create_new_error(ErrorType.WARNING, e.args[0])
+        return
+
+    if session is None or len(session.dirs) == 0:
+        return
+
+    archives = [path for path in session.dirs if path.endswith(ARCHIVE_EXTENSION)]
+    restored, changed = restore_dirs([path for path in session.dirs if not path.endswith(ARCHIVE_EXTENSION)], state.summaries.get)
+
+    errors = [result for result in restored if isinstance(result, InvalidInstagramDir)]
+    if len(errors) == 1:
+        create_new_error(ErrorType.WARNING, errors[0].args[0])
+    elif len(errors) > 1:
+        create_new_error(ErrorType.WARNING, f"{len(errors)} folders from the last session couldn't be loaded again. First one:\n{errors[0].args[0]}")
+
+    for result in restored:
+        if isinstance(result, InstagramDir):
+            state_insert_dir(result)
+    state_open_archives(archives, ErrorType.WARNING)
+
+    if len(changed) > 0:
+        revalidate_in_background(changed, state.cache if state.outofcore is None and state.cache.budget is None else None, state.revalidated)
+
+    if len(state.dirs) == 0:
+        return
+
+    state.method = Method[session.method] if session.method in Method.__members__ else state.method
+    state.target = Target[session.target] if session.target in Target.__members__ else state.target
+    state.order = Order[session.order] if session.order in Order.__members__ else state.order
+
+    paths = [folder.path for folder in state.dirs]
+    selected = sorted(paths.index(path) for path in session.selected if path in paths)
+    state.selected = (selected[0], selected[1]) if len(selected) == 2 else (selected[0], None) if len(selected) == 1 else (None, None)
+
+    state.scenename = "main"
+    state_update_users()
+    mainscene_update_visuals()
+
+    for name, start in session.scroll.items():
+        button = state.scenes["main"].buttons.get(name)
+        if button is not None and button.nparrs > 0:
+            button.start = min(max(0, start), button.nparrs - 1)
+
+# Exports are only read here, when closing, so archiving never slows the app down while it's used
+# Returns whether it's fine to close, a failure is shown and closing again quits without archiving
+def state_save_archives(dirpath: str) -> bool:
+
+    global state
+
+    if len(state.dirs) == 0:
+        return True
+
+    try:
+        save_archives(state.dirs, state.cache, dirpath)
+    except (OSError, InvalidInstagramDir) as e:
+        create_new_error(ErrorType.ERROR, f"Couldn't archive the loaded folders in {dirpath}\n{e}\nClose lcmp again to quit without archiving them")
+        return False
+
+    return True
+
+def parse_args() -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(description = CAPTION)
+    parser.add_argument("--watch", metavar = "DIR", action = "append", default = [], help = "Directory where new exports are dropped. New instagram-* folders or zips are loaded automatically. Can be repeated")
+    parser.add_argument("--watch-interval", metavar = "SECONDS", type = float, default = 2.0, help = "How often watched directories are polled")
+    parser.add_argument("--workers", metavar = "N", type = int, default = 0, help = "Parse exports in N worker processes, sharing the results through shared memory. Comparisons of big exports are split across them too")
+    parser.add_argument("--memory-budget", metavar = "MB", type = float, default = None, help = "Compare exports on disk, using about this much memory. For exports too big to fit in memory. Retention and expressions need whole exports in memory and are turned off")
+    parser.add_argument("--cache-budget", metavar = "MB", type = float, default = None, help = "Keep about this much parsed data in memory, parsing again the least recently used exports when needed. Exports next to the selected ones are parsed ahead while idle")
+    parser.add_argument("--fresh", action = "store_true", help = "Start without the folders of the last session, which is left as it was when closing")
+    parser.add_argument("--serve", metavar = "PORT", type = int, default = None, help = "Answer comparison queries as JSON over HTTP on 127.0.0.1:PORT (0 picks a free port)")
+    parser.add_argument("--archive", metavar = "DIR", default = None, help = "Open the archives in DIR, and on exit keep the loaded exports of every account there as a single compact file per account")
+
+    args = parser.parse_args()
+    if args.archive is not None and args.memory_budget is not None:
+        parser.error("--archive reads whole exports into memory, it can't be used with --memory-budget")
+    if args.serve is not None and args.memory_budget is not None:
+        parser.error("--serve answers from whole exports in memory, it can't be used with --memory-budget")
+
+    return args
 
 def main() -> None:
 
     global state
+    args = parse_args()
 
     state.scenename = str("welcome") # str("welcome") instead of "welcome" so Pylance doesn't complain with: "Condition will always evaluate to False since the types "Literal['welcome']" and "Literal['main']" have no overlapPylancereportUnnecessaryComparison"
     state.scenes = {
         "welcome": WELCOME_SCENE,
         "main": MAIN_SCENE,
+        "cohorts": COHORTS_SCENE,
     }
 
     state.scenes["main"].buttons["dir-list"].parrcallback  = mainscene_click_folder
     state.scenes["main"].buttons["user-list"].parrcallback = mainscene_click_user
+    state.scenes["main"].buttons["user-list"].altparrcallback = mainscene_history_user
     state.scenes["main"].buttons["switch-target"].callback = mainscene_switch_target
     state.scenes["main"].buttons["switch-method"].callback = mainscene_switch_method
+    state.scenes["main"].buttons["switch-order"].callback  = mainscene_switch_order
+    state.scenes["main"].buttons["cohorts"].callback       = mainscene_open_cohorts
+    state.scenes["cohorts"].buttons["back"].callback       = cohortsscene_back
+
+    state.cache.set_workers(args.workers)
+    if args.cache_budget is not None:
+        state.cache.set_budget(int(args.cache_budget * 1024 * 1024))
+    state.cache.set_store(os.path.join(cache_dir(), "snapshots"))
+    state.summaries.load()
+
+    if args.memory_budget is not None:
+        # A fresh start keeps its runs temporary, the last session's are left as they were
+        state.outofcore = OutOfCore(int(args.memory_budget * 1024 * 1024), None if args.fresh else os.path.join(cache_dir(), "runs"))
+
+    if len(args.watch) > 0:
+        state.watcher = FolderWatcher(args.watch, state.cache if state.outofcore is None else None, args.watch_interval, state.summaries.get)
+        state.watcher.start()
+
+    if args.serve is not None:
+        state.server = QueryServer(QueryService(lambda: list(state.dirs), state.cache, state.index), args.serve)
+        print(f"Serving queries on http://127.0.0.1:{state.server.start_in_background()}")
 
     pygame.init()
     clock = pygame.time.Clock()
@@ -425,6 +1027,21 @@ def main() -> None:
     except Exception:
         ...
 
+    if not args.fresh:
+        state_restore_session()
+
+    if args.archive is not None and state_open_archives(find_archives(args.archive), ErrorType.WARNING):
+        if state.scenename == "welcome":
+            state.scenename = "main"
+            state_update_users()
+        if state.scenename == "main":
+            mainscene_update_visuals()
+
+    archived = False
+
+    inputevents = (pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.MOUSEWHEEL, pygame.DROPBEGIN, pygame.DROPFILE)
+    lastinput = pygame.time.get_ticks()
+
     running = True
     while running:
 
@@ -433,8 +1050,16 @@ def main() -> None:
 
         for event in pygame.event.get():
 
+            if event.type in inputevents:
+                lastinput = pygame.time.get_ticks()
+
+            # The loaded exports are archived before closing. A failure is shown instead, and closing again quits anyway
             if event.type == pygame.QUIT:
-                running = False
+                if args.archive is None or archived:
+                    running = False
+                else:
+                    archived = True
+                    running = not state_save_archives(args.archive)
 
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_UP:
@@ -442,6 +1067,23 @@ def main() -> None:
                 elif event.key == pygame.K_DOWN:
                     state.downpressed = True
 
+            # '/' starts writing a query in the phrases box, Enter runs it and Escape cancels it
+            if event.type == pygame.TEXTINPUT and state.scenename == "main":
+                if state.typing is not None:
+                    state.typing += event.text
+                    mainscene_update_visuals()
+                elif event.text == "/":
+                    mainscene_start_query()
+
+            if event.type == pygame.KEYDOWN and state.scenename == "main" and state.typing is not None:
+                if event.key == pygame.K_BACKSPACE:
+                    state.typing = state.typing[:-1]
+                    mainscene_update_visuals()
+                elif event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+                    mainscene_run_query()
+                elif event.key == pygame.K_ESCAPE:
+                    mainscene_cancel_query()
+
             if event.type == pygame.KEYUP:
                 if event.key == pygame.K_UP:
                     state.uppressed = False
@@ -450,8 +1092,13 @@ def main() -> None:
 
             if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                 for button in state.scenes[state.scenename].buttons.values():
-                    button.click(mouseX / ww, mouseY / wh, None)
-                    button.click_parr(mouseX, mouseY, window, button)
+                    if button.click(mouseX / ww, mouseY / wh, None)[0] or button.click_parr(mouseX, mouseY, window, button)[0]:
+                        break
+
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 3:
+                for button in state.scenes[state.scenename].buttons.values():
+                    if button.click_parr(mouseX, mouseY, window, button, alt = True)[0]:
+                        break
 
             if event.type == pygame.MOUSEWHEEL:
                 for textbox in state.scenes[state.scenename].textboxes.values():
@@ -459,8 +1106,29 @@ def main() -> None:
                 for button in state.scenes[state.scenename].buttons.values():
                     button.scroll_parrs(mouseX, mouseY, window, -event.y)
 
+            if event.type == pygame.DROPBEGIN:
+                state.dropping = True
+
             if event.type == pygame.DROPFILE:
-                handle_dropfile(event.file)
+                state.dropped.append(event.file)
+
+            if event.type == pygame.DROPCOMPLETE:
+                state.dropping = False
+
+        # Everything dropped at once is loaded as a single batch
+        if not state.dropping and len(state.dropped) > 0:
+            handle_dropfiles(state.dropped)
+            state.dropped = []
+
+        handle_watcher_events()
+        handle_loaded_events(state.revalidated, "again, it changed since the last session")
+        handle_annotated_events()
+
+        # Speculative parsing only runs while the user isn't doing anything, so it never competes with a click
+        if pygame.time.get_ticks() - lastinput > IDLE_AFTER_MS and not state.uppressed and not state.downpressed:
+            state.cache.idle.set()
+        else:
+            state.cache.idle.clear()
 
         if state.uppressed:
             for textbox in state.scenes[state.scenename].textboxes.values():
@@ -492,6 +1160,21 @@ def main() -> None:
         pygame.display.flip()
         clock.tick(FPS)
 
+    if state.watcher is not None:
+        state.watcher.stop()
+
+    if state.server is not None:
+        state.server.stop_in_background()
+
+    # A fresh start leaves the last session, and the parses it keeps in the store, as they were
+    if not args.fresh:
+        state_save_session()
+
+    if state.outofcore is not None:
+        state.outofcore.close()
+
+    state.cache.close()
+
     pygame.quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import os
+import json
+import zlib
+import bisect
+
+from array import array
+from modules.cache import ParseCache
+from modules.ig import InstagramDir, Target, Date, Connections, Summary, NO_TIMESTAMP, combine_fingerprints
+
+ARCHIVE_MAGIC = b"LCMPARC1"
+ARCHIVE_VERSION = 2
+ARCHIVE_EXTENSION = ".lcmparc"
+CHECKPOINT_EVERY = 16
+
+class InvalidArchive(Exception):
+    ...
+
+# Either a full copy of a snapshot (checkpoint) or what changed since the previous one
+# Entries are kept sorted by username in parallel lists
+class Frame:
+
+    def __init__(self, usernames: list[str], urls: list[str], stamps: array[int], removed: list[str] | None = None) -> None:
+        self.usernames = usernames
+        self.urls = urls
+        self.stamps = stamps
+        self.removed = removed
+
+    @property
+    def ischeckpoint(self) -> bool:
+        return self.removed is None
+
+    @staticmethod
+    def checkpoint(connections: Connections) -> Frame:
+        return Frame(list(connections.usernames), list(connections.urls), array('q', connections.stamps))
+
+    # Users whose url or follow date changed are stored as removed and added again
+    @staticmethod
+    def delta(prev: Connections, curr: Connections) -> Frame:
+
+        usernames: list[str] = []
+        urls: list[str] = []
+        stamps = array('q')
+        removed: list[str] = []
+
+        i = j = 0
+        while i < len(prev.usernames) or j < len(curr.usernames):
+
+            if j == len(curr.usernames) or (i < len(prev.usernames) and prev.usernames[i] < curr.usernames[j]):
+                removed.append(prev.usernames[i])
+                i += 1
+                continue
+
+            if i == len(prev.usernames) or curr.usernames[j] < prev.usernames[i]:
+                usernames.append(curr.usernames[j])
+                urls.append(curr.urls[j])
+                stamps.append(curr.stamps[j])
+                j += 1
+                continue
+
+            if prev.urls[i] != curr.urls[j] or prev.stamps[i] != curr.stamps[j]:
+                removed.append(prev.usernames[i])
+                usernames.append(curr.usernames[j])
+                urls.append(curr.urls[j])
+                stamps.append(curr.stamps[j])
+
+            i += 1
+            j += 1
+
+        return Frame(usernames, urls, stamps, removed)
+
+    def nentries(self) -> int:
+        return len(self.usernames) + (0 if self.removed is None else len(self.removed))
+
+# A username's series of snapshots: full checkpoints every CHECKPOINT_EVERY snapshots and sorted deltas in between
+# Rebuilding a snapshot replays at most CHECKPOINT_EVERY - 1 deltas over the closest checkpoint
+class SnapshotArchive:
+
+    def __init__(self, username: str, checkpoint_every: int = CHECKPOINT_EVERY) -> None:
+
+        assert checkpoint_every > 0
+
+        self.username = username
+        self.checkpoint_every = checkpoint_every
+
+        self.dates: list[Date] = []
+        self.uuids: list[str] = []
+        # What the snapshots are known by without rebuilding them: the fingerprints of the exports they come from and their sizes
+        self.fingerprints: list[dict[Target, str]] = []
+        self.counts: list[dict[Target, int]] = []
+        self.frames: dict[Target, list[Frame]] = {target: [] for target in Target}
+
+        # Last appended snapshot of each target, deltas are computed against it
+        self._last: dict[Target, Connections] = {}
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def append(self, date: Date, uuid: str, connections: dict[Target, Connections], fingerprints: dict[Target, str]) -> None:
+
+        if len(self.dates) > 0 and date < self.dates[-1]:
+            raise ValueError(f"Snapshots must be appended in order, {date.str} is older than {self.dates[-1].str}")
+
+        ischeckpoint = len(self.dates) % self.checkpoint_every == 0
+
+        for target in Target:
+            curr = connections[target]
+            self.frames[target].append(Frame.checkpoint(curr) if ischeckpoint else Frame.delta(self._last[target], curr))
+            self._last[target] = curr
+
+        self.dates.append(date)
+        self.uuids.append(uuid)
+        self.fingerprints.append(dict(fingerprints))
+        self.counts.append({target: len(connections[target]) for target in Target})
+
+    def find(self, date: Date) -> int | None:
+        i = bisect.bisect_left(self.dates, date)
+        return i if i < len(self.dates) and self.dates[i] == date else None
+
+    def get(self, i: int, target: Target) -> Connections:
+
+        if not 0 <= i < len(self.dates):
+            raise IndexError(i)
+
+        frames = self.frames[target]
+        base = i - i % self.checkpoint_every
+        assert frames[base].ischeckpoint
+
+        users = dict(zip(frames[base].usernames, frames[base].urls))
+        stamps = dict(zip(frames[base].usernames, frames[base].stamps))
+
+        for frame in frames[base+1:i+1]:
+            assert frame.removed is not None
+            for username in frame.removed:
+                del users[username]
+                del stamps[username]
+            users.update(zip(frame.usernames, frame.urls))
+            stamps.update(zip(frame.usernames, frame.stamps))
+
+        return Connections(users, {username: stamp for username, stamp in stamps.items() if stamp != NO_TIMESTAMP})
+
+    def save(self, path: str) -> None:
+
+        # Urls are almost always a common prefix followed by the username, so only the prefix index is stored
+        prefixes: dict[str, int] = {}
+
+        def encode_url(username: str, url: str) -> int | str:
+            if not url.endswith(username):
+                return url
+            return prefixes.setdefault(url[:len(url)-len(username)], len(prefixes))
+
+        def encode_frame(frame: Frame) -> dict[str, object]:
+            encoded: dict[str, object] = {
+                "usernames": frame.usernames,
+                "urls": [encode_url(username, url) for username, url in zip(frame.usernames, frame.urls)],
+                "stamps": frame.stamps.tolist(),
+            }
+            if frame.removed is not None:
+                encoded["removed"] = frame.removed
+            return encoded
+
+        series = {target.name: [encode_frame(frame) for frame in self.frames[target]] for target in Target}
+
+        body = json.dumps({
+            "version": ARCHIVE_VERSION,
+            "username": self.username,
+            "checkpoint_every": self.checkpoint_every,
+            "dates": [date.str for date in self.dates],
+            "uuids": self.uuids,
+            "fingerprints": [{target.name: fingerprint for target, fingerprint in fingerprints.items()} for fingerprints in self.fingerprints],
+            "counts": [{target.name: count for target, count in counts.items()} for counts in self.counts],
+            "prefixes": list(prefixes.keys()),
+            "series": series,
+        }, separators = (',', ':'))
+
+        with open(path + ".tmp", "wb") as f:
+            f.write(ARCHIVE_MAGIC)
+            f.write(zlib.compress(body.encode(), 9))
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path: str) -> SnapshotArchive:
+
+        with open(path, "rb") as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise InvalidArchive(f"{path} is not an lcmp archive")
+            try:
+                data = json.loads(zlib.decompress(f.read()))
+            except (zlib.error, ValueError) as e:
+                raise InvalidArchive(f"{path} is corrupted\n{e}")
+
+        try:
+            if data.get("version") != ARCHIVE_VERSION:
+                raise InvalidArchive(f"{path} was written by another version of lcmp\nArchive its exports again")
+
+            archive = SnapshotArchive(data["username"], data["checkpoint_every"])
+            prefixes: list[str] = data["prefixes"]
+
+            def decode_frame(encoded: dict) -> Frame:
+                usernames: list[str] = encoded["usernames"]
+                urls = [url if isinstance(url, str) else prefixes[url] + username for username, url in zip(usernames, encoded["urls"])]
+                return Frame(usernames, urls, array('q', encoded["stamps"]), encoded.get("removed"))
+
+            archive.dates = [Date.fromstr(datestr) for datestr in data["dates"]]
+            archive.uuids = data["uuids"]
+            archive.fingerprints = [{Target[name]: fingerprint for name, fingerprint in saved.items()} for saved in data["fingerprints"]]
+            archive.counts = [{Target[name]: count for name, count in saved.items()} for saved in data["counts"]]
+            if not len(archive.dates) == len(archive.uuids) == len(archive.fingerprints) == len(archive.counts):
+                raise InvalidArchive(f"{path} is corrupted\nIt doesn't describe all of its {len(archive.dates)} snapshots")
+
+            for target in Target:
+                archive.frames[target] = [decode_frame(encoded) for encoded in data["series"][target.name]]
+                if len(archive.frames[target]) != len(archive.dates):
+                    raise InvalidArchive(f"{path} is corrupted\nIt has {len(archive.dates)} dates but {len(archive.frames[target])} {target.name.lower()} snapshots")
+                if len(archive.dates) > 0:
+                    archive._last[target] = archive.get(len(archive.dates) - 1, target)
+
+        except (KeyError, TypeError, ValueError, IndexError) as e:
+            raise InvalidArchive(f"{path} is corrupted\n{e!r}")
+
+        return archive
+
+    @staticmethod
+    def from_dirs(dirs: list[InstagramDir], cache: ParseCache, checkpoint_every: int = CHECKPOINT_EVERY) -> SnapshotArchive:
+
+        usernames = {instagram_dir.username for instagram_dir in dirs}
+        if len(usernames) != 1:
+            raise ValueError(f"An archive holds the snapshots of a single username, got {len(usernames)}")
+
+        archive = SnapshotArchive(usernames.pop(), checkpoint_every)
+        for instagram_dir in sorted(dirs, key = lambda x: x.date):
+            archive.append(instagram_dir.date, instagram_dir.uuid, {target: cache.get(instagram_dir, target) for target in Target}, instagram_dir.fingerprints)
+
+        return archive
+
+# A snapshot read back from an archive, shown and compared like the export it was made from. Nothing is rebuilt until
+# one of its targets is asked for, and having the same fingerprints the parse is shared with that export if it's loaded
+class ArchivedDir(InstagramDir):
+
+    isfolder = False
+
+    def __init__(self, archive: SnapshotArchive, archivepath: str, i: int) -> None:
+        self.archive = archive
+        self.archivepath = archivepath
+        self.i = i
+        self.username = archive.username
+        self.date = archive.dates[i]
+        self.uuid = archive.uuids[i]
+        self.path = f"{archivepath}@{self.date.str}#{self.uuid}"
+        self.summary = Summary((), archive.fingerprints[i], archive.counts[i])
+        self.signature = self.summary.signature
+        self.fingerprints = self.summary.fingerprints
+        self.fingerprint = combine_fingerprints(self.fingerprints)
+
+    def extract(self, target: Target) -> Connections:
+        return self.archive.get(self.i, target)
+
+def open_archive(path: str) -> list[ArchivedDir]:
+    path = os.path.abspath(path)
+    archive = SnapshotArchive.load(path)
+    return [ArchivedDir(archive, path, i) for i in range(len(archive))]
+
+# The archives save_archives left in dirpath, none if it doesn't exist yet
+def find_archives(dirpath: str) -> list[str]:
+    try:
+        return sorted(entry.path for entry in os.scandir(dirpath) if entry.is_file() and entry.name.endswith(ARCHIVE_EXTENSION))
+    except FileNotFoundError:
+        return []
+
+# Every account with loaded exports gets its own archive in dirpath, named after it. Returns the written paths
+def save_archives(dirs: list[InstagramDir], cache: ParseCache, dirpath: str) -> list[str]:
+
+    accounts: dict[str, list[InstagramDir]] = {}
+    for instagram_dir in dirs:
+        accounts.setdefault(instagram_dir.username, []).append(instagram_dir)
+
+    os.makedirs(dirpath, exist_ok = True)
+
+    paths: list[str] = []
+    for username, account_dirs in accounts.items():
+        path = os.path.join(dirpath, username + ARCHIVE_EXTENSION)
+        SnapshotArchive.from_dirs(account_dirs, cache).save(path)
+        paths.append(path)
+
+    return paths
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+
+import modules.ig as ig
+import modules.shared as shared
+
+from typing import Callable
+from collections import OrderedDict
+from multiprocessing import get_context, get_all_start_methods
+from modules.shared import SharedSnapshot, PackedStrings, InvalidSnapshot
+from modules.frontcoded import FrontCodedStrings
+from modules.ig import InstagramDir, Target, Connections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Rough bytes around every parsed user besides its front coded username and url: its stamp and timeline entries
+USER_OVERHEAD = 20
+
+def cache_dir() -> str:
+
+    if sys.platform == "win32":
+        root = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+    path = os.path.join(root, "lcmp")
+    os.makedirs(path, exist_ok = True)
+    return path
+
+def get_size(connections: Connections) -> int:
+    if isinstance(connections, SharedSnapshot):
+        return len(connections.buf)
+    assert isinstance(connections.usernames, FrontCodedStrings) and isinstance(connections.urls, FrontCodedStrings)
+    return connections.usernames.nbytes + connections.urls.nbytes + USER_OVERHEAD * len(connections)
+
+# Keyed by the content of the parsed files, so exports holding the same data share a single parse
+# With workers, exports are parsed in other processes and read from shared memory without unpickling them
+# With a budget, the least recently used parses are dropped once they take more than budget bytes
+# With a store, parses persisted there by an earlier run are mapped from disk instead of parsed again
+class ParseCache:
+
+    def __init__(self, on_parsed: Callable[[InstagramDir, Target, Connections], None] | None = None) -> None:
+        self._lock = threading.Lock()
+        self._parsed: OrderedDict[tuple[str, Target], Connections] = OrderedDict()
+        self._sizes: dict[tuple[str, Target], int] = {}
+        self._bytes = 0
+        self._inflight: dict[tuple[str, Target], threading.Event] = {}
+        self._pool: ThreadPoolExecutor | None = None
+        self._prefetcher: ThreadPoolExecutor | None = None
+        self._notifier: ThreadPoolExecutor | None = None
+        self._processes: ProcessPoolExecutor | None = None
+        self.workers = 0
+        self._generation = 0
+        self.on_parsed = on_parsed
+        self.budget: int | None = None
+        self.store: str | None = None
+
+        # Cleared by the UI while the user is interacting, speculative parses wait for it
+        self.idle = threading.Event()
+        self.idle.set()
+
+    # Workers are never forked from the app, which has pygame and its threads running. Started by a fork server or spawned,
+    # they're handed the app's resource tracker, so every shared memory name is tracked once for the whole app, and it's
+    # unlinked by the app when it's evicted, or by the tracker if the app dies without doing it
+    def set_workers(self, workers: int) -> None:
+        if workers > 0:
+            context = get_context("forkserver" if "forkserver" in get_all_start_methods() else "spawn")
+            self._processes = ProcessPoolExecutor(max_workers = workers, mp_context = context)
+            self.workers = workers
+
+    # Shared with whatever else splits work across the workers, like diffs of big exports
+    @property
+    def processes(self) -> ProcessPoolExecutor | None:
+        return self._processes
+
+    def set_store(self, path: str) -> None:
+        os.makedirs(path, exist_ok = True)
+        self.store = path
+
+    def set_budget(self, budget: int | None) -> None:
+        with self._lock:
+            self.budget = budget
+            self.evict()
+
+    def close(self) -> None:
+
+        # Cancels any speculation and wakes it up so it can see that
+        with self._lock:
+            self._generation += 1
+        self.idle.set()
+
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown(wait = False, cancel_futures = True)
+
+        if self._notifier is not None:
+            self._notifier.shutdown(wait = False, cancel_futures = True)
+
+        if self._processes is not None:
+            self._processes.shutdown(cancel_futures = True)
+
+        with self._lock:
+            for connections in self._parsed.values():
+                if isinstance(connections, SharedSnapshot):
+                    connections.close()
+                    connections.unlink()
+            self._parsed.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def parse(self, instagram_dir: InstagramDir, target: Target) -> Connections:
+
+        if self.store is not None:
+            try:
+                snapshot = SharedSnapshot.from_file(self.stored_path(instagram_dir, target))
+            except (OSError, ValueError, InvalidSnapshot):
+                ...
+            else:
+                # Usernames are walked by every comparison, front coded they're searched without decoding one at every probe
+                # Urls are only read for the rows shown
+                assert isinstance(snapshot.usernames, PackedStrings)
+                snapshot.usernames = FrontCodedStrings(snapshot.usernames.tolist())
+                return snapshot
+
+        if self._processes is None or not instagram_dir.isfolder:
+            return instagram_dir.extract(target)
+        return SharedSnapshot.attach(self._processes.submit(shared.parse_to_shared, instagram_dir.path, target).result())
+
+    # Named after the content fingerprint, so a folder whose files changed never maps a stale parse
+    def stored_path(self, instagram_dir: InstagramDir, target: Target) -> str:
+        assert self.store is not None
+        return os.path.join(self.store, f"{instagram_dir.fingerprints[target]}-{target.name.lower()}.snp")
+
+    # Writes the parses of dirs that are in memory but not in the store yet, and removes the stored parses of any other folder
+    def persist(self, dirs: list[InstagramDir]) -> None:
+
+        assert self.store is not None
+
+        wanted: set[str] = set()
+        for instagram_dir in dirs:
+            for target in Target:
+                path = self.stored_path(instagram_dir, target)
+                wanted.add(os.path.basename(path))
+                with self._lock:
+                    connections = self._parsed.get(self.key(instagram_dir, target))
+                if connections is not None and not os.path.isfile(path):
+                    # Written next to the final path and renamed, so a crash never leaves a truncated parse behind
+                    SharedSnapshot.write_file(connections, path + ".tmp")
+                    os.replace(path + ".tmp", path)
+
+        for entry in os.scandir(self.store):
+            if entry.name not in wanted:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    ...
+
+    def key(self, instagram_dir: InstagramDir, target: Target) -> tuple[str, Target]:
+        return instagram_dir.fingerprints[target], target
+
+    def has(self, instagram_dir: InstagramDir, target: Target) -> bool:
+        with self._lock:
+            return self.key(instagram_dir, target) in self._parsed
+
+    # With acquire, the parse is held for whoever keeps it (see Connections.acquire) before anything can evict it
+    def get(self, instagram_dir: InstagramDir, target: Target, acquire: bool = False) -> Connections:
+
+        key = self.key(instagram_dir, target)
+
+        # Whoever asks first parses, anyone asking for the same key meanwhile (a prefetch and a click) waits for that parse
+        while True:
+            with self._lock:
+                connections = self._parsed.get(key)
+                if connections is not None:
+                    self._parsed.move_to_end(key)
+                    self.hold(connections, acquire)
+                    break
+                pending = self._inflight.get(key)
+                isowner = pending is None
+                if pending is None:
+                    pending = self._inflight[key] = threading.Event()
+
+            if not isowner:
+                pending.wait()
+                continue
+
+            try:
+                connections = self.parse(instagram_dir, target)
+                size = get_size(connections)
+                with self._lock:
+                    self._parsed[key] = connections
+                    self._sizes[key] = size
+                    self._bytes += size
+                    self.hold(connections, acquire)
+                    self.evict()
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                pending.set()
+            break
+
+        # Told from another thread, so whatever it does with the parse never delays the one asking for it
+        if self.on_parsed is not None:
+            with self._lock:
+                if self._notifier is None:
+                    self._notifier = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "lcmp-notify")
+            self._notifier.submit(self.notify, instagram_dir, target, connections)
+
+        return connections
+
+    # Must hold the lock. The notifier keeps the parse too
+    def hold(self, connections: Connections, acquire: bool) -> None:
+        if acquire:
+            connections.acquire()
+        if self.on_parsed is not None:
+            connections.acquire()
+
+    def notify(self, instagram_dir: InstagramDir, target: Target, connections: Connections) -> None:
+        assert self.on_parsed is not None
+        try:
+            self.on_parsed(instagram_dir, target, connections)
+        finally:
+            connections.release()
+
+    # Every parse a view is made of, held (see get). If one of them can't be parsed none is held
+    def acquire_all(self, wanted: list[tuple[InstagramDir, Target]]) -> list[Connections]:
+
+        held: list[Connections] = []
+
+        try:
+            for instagram_dir, target in wanted:
+                held.append(self.get(instagram_dir, target, acquire = True))
+        except BaseException:
+            for connections in held:
+                connections.release()
+            raise
+
+        return held
+
+    # Must hold the lock. The most recent parse always stays, views still holding an evicted one keep it mapped
+    def evict(self) -> None:
+
+        while self.budget is not None and self._bytes > self.budget and len(self._parsed) > 1:
+            key, connections = self._parsed.popitem(last = False)
+            self._bytes -= self._sizes.pop(key)
+            if isinstance(connections, SharedSnapshot):
+                connections.retire()
+
+    def load(self, instagram_dir: InstagramDir) -> None:
+        for target in Target:
+            self.get(instagram_dir, target)
+
+    # Every target is its own job. With workers there's a thread waiting on each of them, so as many parses as workers
+    # run at once. Without them parsing holds the GIL, and a single thread is enough
+    def load_in_background(self, instagram_dir: InstagramDir) -> None:
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers = max(1, self.workers), thread_name_prefix = "lcmp-parse")
+
+        # Whatever fails here fails again, and is reported, when the parse is asked for
+        def load_quietly(target: Target) -> None:
+            try:
+                self.get(instagram_dir, target)
+            except (OSError, ig.InvalidInstagramDir):
+                ...
+
+        for target in Target:
+            self._pool.submit(load_quietly, target)
+
+    # Parses wanted in the background while the UI is idle, most likely first
+    # A new call cancels what's left of the previous one
+    def prefetch(self, wanted: list[tuple[InstagramDir, Target]]) -> None:
+
+        keys = {self.key(instagram_dir, target) for instagram_dir, target in wanted}
+
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+
+        if self._prefetcher is None:
+            self._prefetcher = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "lcmp-prefetch")
+
+        def run() -> None:
+            for instagram_dir, target in wanted:
+                self.idle.wait()
+                with self._lock:
+                    if generation != self._generation:
+                        return
+                    # Speculation only ever pushes out parses older than the ones it was asked for
+                    if self.budget is not None and self._bytes >= self.budget and self._parsed and next(iter(self._parsed)) in keys:
+                        return
+                if self.has(instagram_dir, target):
+                    continue
+                try:
+                    self.get(instagram_dir, target)
+                except (OSError, ig.InvalidInstagramDir):
+                    ...
+
+        self._prefetcher.submit(run)
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import numpy as np
+
+from typing import Callable
+from modules.ig import InstagramDir, Target, Connections
+
+# Follower cohorts of one account across its snapshots, in date order
+# Cohort i are the users that appear in snapshot i but not in snapshot i - 1 (cohort 0 is everyone in the first snapshot)
+# Everything is computed on a snapshots x users presence matrix, users being numbered across all snapshots
+class Cohorts:
+
+    def __init__(self, snapshots: list[InstagramDir], connections: list[Connections]) -> None:
+
+        self.snapshots = snapshots
+
+        # Every username gets the id of its position among all the distinct usernames
+        names = [np.array(list(conn.usernames), dtype = str) for conn in connections]
+        sizes = np.array([len(x) for x in names], dtype = np.int64)
+        allnames = np.concatenate(names) if len(names) > 0 else np.array([], dtype = str)
+        self.usernames, ids = np.unique(allnames, return_inverse = True)
+
+        n = len(snapshots)
+        self.presence = np.zeros((n, len(self.usernames)), dtype = bool)
+        self.presence[np.repeat(np.arange(n), sizes), ids] = True
+
+        self.gained = self.presence.copy()
+        self.gained[1:] &= ~self.presence[:-1]
+        self.lost = np.zeros_like(self.presence)
+        self.lost[1:] = self.presence[:-1] & ~self.presence[1:]
+
+        # followed[i, j]: users of cohort i present in snapshot j, as one matrix product
+        # float32 counts are exact below 2^24 users, BLAS makes it much faster than integer products
+        dtype = np.float32 if len(self.usernames) < 1 << 24 else np.float64
+        followed = (self.gained.astype(dtype) @ self.presence.T.astype(dtype)).astype(np.int64)
+
+        # Shifted so retention[i, k] are the users of cohort i still following k snapshots later, -1 past the last snapshot
+        later = np.arange(n)[:, None] + np.arange(n)[None, :]
+        self.retention = np.where(later < n, np.take_along_axis(followed, np.minimum(later, n - 1), axis = 1), -1)
+        self.sizes = self.retention[:, 0] if n > 0 else np.zeros(0, dtype = np.int64)
+        self.churn = np.where(self.retention >= 0, self.sizes[:, None] - self.retention, -1)
+
+    def __len__(self) -> int:
+        return len(self.snapshots)
+
+    # Fraction of every cohort still following k snapshots later, nan where it can't be known
+    def rates(self) -> np.ndarray:
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            return np.where((self.retention >= 0) & (self.sizes[:, None] > 0), self.retention / self.sizes[:, None], np.nan)
+
+    # Followers, gained and lost in every snapshot compared to the previous one
+    def totals(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self.presence.sum(axis = 1), self.gained.sum(axis = 1), self.lost.sum(axis = 1)
+
+    # One paragraph per row, TextBox wraps collapsing spaces so nothing relies on alignment
+    def table(self) -> list[str]:
+
+        if len(self) == 0:
+            return []
+
+        rates = self.rates()
+        followers, gained, lost = self.totals()
+
+        lines = ["Followers gained in every export that still follow 1, 2, 3... exports later", ""]
+        for i, folder in enumerate(self.snapshots):
+            kind = "followers in the first export" if i == 0 else "gained"
+            later = " ".join(f"{rate:.0%}" for rate in rates[i, 1:] if not np.isnan(rate))
+            lines.append(f"{folder.date.str} {self.sizes[i]} {kind}" + ("" if later == "" else f", still following: {later}"))
+
+        lines += ["", "Followers lost since the previous export", ""]
+        for j, folder in enumerate(self.snapshots[1:], 1):
+            churn = "" if followers[j - 1] == 0 else f" ({lost[j] / followers[j - 1]:.1%} churn)"
+            lines.append(f"{folder.date.str} {followers[j]} followers, {gained[j]} gained, {lost[j]} lost{churn}")
+
+        return lines
+
+def snapshots_of(dirs: list[InstagramDir], username: str) -> list[InstagramDir]:
+    return sorted((folder for folder in dirs if folder.username == username), key = lambda x: x.date)
+
+def get_cohorts(dirs: list[InstagramDir], username: str, get: Callable[[InstagramDir, Target], Connections], target: Target = Target.FOLLOWERS) -> Cohorts:
+    snapshots = snapshots_of(dirs, username)
+    return Cohorts(snapshots, [get(folder, target) for folder in snapshots])
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import os
+import heapq
+import shutil
+import tempfile
+
+from typing import Iterator, IO
+from modules.views import Method
+from modules.ig import InstagramDir, Target, UsersExtractor, NO_TIMESTAMP, get_target_files
+
+# Rough size of a parsed user in memory: the dict entries plus the username and url objects
+ENTRY_COST = 200
+READ_CHUNK_SIZE = 1 << 20
+
+Record = tuple[str, str, str]
+
+# A run is a text file of username, url and follow timestamp separated by tabs, one user per line, sorted by username
+def write_record(f: IO[str], username: str, url: str, stamp: int) -> None:
+    f.write(f"{username}\t{url}\t{stamp}\n")
+
+def read_run(path: str) -> Iterator[Record]:
+    with open(path, encoding = "utf-8") as f:
+        for line in f:
+            username, url, stamp = line.rstrip('\n').split('\t')
+            yield username, url, stamp
+
+# Users sharing a username keep the record of the latest run, like a dict would
+def merge_runs(paths: list[str], outpath: str) -> None:
+
+    with open(outpath, "w", encoding = "utf-8") as out:
+        prev: Record | None = None
+        for record in heapq.merge(*(read_run(path) for path in paths), key = lambda record: record[0]):
+            if prev is not None and prev[0] != record[0]:
+                out.write('\t'.join(prev) + '\n')
+            prev = record
+        if prev is not None:
+            out.write('\t'.join(prev) + '\n')
+
+# Spills what it parsed to a sorted run on disk every time it goes over the budget
+class SpillingExtractor(UsersExtractor):
+
+    def __init__(self, budget: int, workdir: str) -> None:
+        super().__init__()
+        self.budget = budget
+        self.workdir = workdir
+        self.runs: list[str] = []
+
+    def spill(self, final: bool = False) -> None:
+
+        # The last user stays in memory, its follow date may still be on its way
+        keep = None if final else self._pending
+        path = os.path.join(self.workdir, f"spill-{len(self.runs)}.run")
+
+        with open(path, "w", encoding = "utf-8") as f:
+            for username in sorted(self.users.keys()):
+                if username != keep:
+                    write_record(f, username, self.users[username], self.timestamps.get(username, NO_TIMESTAMP))
+
+        self.runs.append(path)
+        self.users = {} if keep is None else {keep: self.users[keep]}
+        self.timestamps = {}
+
+    def feed_file(self, filepath: str) -> None:
+        with open(filepath, encoding = "utf-8") as f:
+            while chunk := f.read(min(READ_CHUNK_SIZE, max(1, self.budget // 4))):
+                self.feed(chunk)
+                if len(self.users) * ENTRY_COST > self.budget:
+                    self.spill()
+
+class RunWriter:
+
+    def __init__(self, path: str, stride: int) -> None:
+        self.path = path
+        self.stride = stride
+        self.offsets: list[int] = []
+        self.count = 0
+        self._file = open(path, "wb")
+
+    def write(self, record: Record) -> None:
+        if self.count % self.stride == 0:
+            self.offsets.append(self._file.tell())
+        self._file.write(('\t'.join(record) + '\n').encode())
+        self.count += 1
+
+    def close(self) -> RunView:
+        self._file.close()
+        return RunView(self.path, self.offsets, self.count, self.stride)
+
+# A sorted run used as the user list. Only one offset every stride records and the last page read are kept in memory
+class RunView:
+
+    def __init__(self, path: str, offsets: list[int], count: int, stride: int) -> None:
+        self.path = path
+        self.offsets = offsets
+        self.count = count
+        self.stride = stride
+        self._page: tuple[int, list[tuple[str, str]]] | None = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def record(self, k: int) -> tuple[str, str]:
+
+        if k < 0:
+            k += self.count
+        if not 0 <= k < self.count:
+            raise IndexError(k)
+
+        page = k // self.stride
+        if self._page is None or self._page[0] != page:
+            with open(self.path, "rb") as f:
+                f.seek(self.offsets[page])
+                records: list[tuple[str, str]] = []
+                for _ in range(min(self.stride, self.count - page * self.stride)):
+                    username, url, _ = f.readline().decode().rstrip('\n').split('\t')
+                    records.append((username, url))
+            self._page = page, records
+
+        return self._page[1][k % self.stride]
+
+    def __getitem__(self, k: int) -> str:
+        return self.record(k)[0]
+
+    def __iter__(self) -> Iterator[str]:
+        return (username for username, _, _ in read_run(self.path))
+
+    def url(self, k: int) -> str:
+        return self.record(k)[1]
+
+    def remove(self) -> None:
+        self._page = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            ...
+
+# Compares exports that don't fit in memory: every export is turned once into a sorted run,
+# then differences are a streaming merge of two runs, so memory stays around the budget
+# Runs are kept in rundir for the next time, pruned like the parses of ParseCache.persist. Without it they're temporary
+class OutOfCore:
+
+    STRIDE = 256
+
+    def __init__(self, budget: int, rundir: str | None = None) -> None:
+        self.budget = budget
+        self.tmpdir = tempfile.mkdtemp(prefix = "lcmp-")
+        self.rundir = os.path.join(self.tmpdir, "runs") if rundir is None else rundir
+        os.makedirs(self.rundir, exist_ok = True)
+        self._results = 0
+
+    def close(self) -> None:
+        shutil.rmtree(self.tmpdir, ignore_errors = True)
+
+    # Named after the content fingerprint, so a folder whose files changed never reads a stale run
+    def run_path(self, instagram_dir: InstagramDir, target: Target) -> str:
+        return os.path.join(self.rundir, f"{instagram_dir.fingerprints[target]}-{target.name.lower()}.run")
+
+    # Removes the runs of any folder that isn't in dirs
+    def prune(self, dirs: list[InstagramDir]) -> None:
+
+        wanted = {os.path.basename(self.run_path(instagram_dir, target)) for instagram_dir in dirs for target in Target}
+
+        for entry in os.scandir(self.rundir):
+            if entry.name not in wanted:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    ...
+
+    def get_run(self, instagram_dir: InstagramDir, target: Target) -> str:
+
+        path = self.run_path(instagram_dir, target)
+        if os.path.isfile(path):
+            return path
+
+        workdir = tempfile.mkdtemp(dir = self.tmpdir)
+        try:
+            parser = SpillingExtractor(self.budget, workdir)
+            files = get_target_files(instagram_dir.path, target)
+            if len(files) == 0:
+                raise FileNotFoundError(2, "No such file or directory", os.path.join(instagram_dir.path, "connections", "followers_and_following", "followers_1.html"))
+            for filepath in files:
+                parser.feed_file(filepath)
+            parser.spill(final = True)
+
+            # Written next to the final path and renamed, so a crash never leaves a truncated run behind
+            merge_runs(parser.runs, path + ".tmp")
+            os.replace(path + ".tmp", path)
+        finally:
+            shutil.rmtree(workdir, ignore_errors = True)
+
+        return path
+
+    # Same semantics as DiffView
+    def diff(self, a: InstagramDir, as_target: Target, b: InstagramDir, bs_target: Target, method: Method) -> RunView:
+
+        assert len(Method) == 3
+
+        apath = self.get_run(a, as_target)
+        bpath = self.get_run(b, bs_target)
+        walkerpath, otherpath = (apath, bpath) if method == Method.AX else (bpath, apath)
+        keep = method == Method.AA
+
+        self._results += 1
+        writer = RunWriter(os.path.join(self.tmpdir, f"result-{self._results}.run"), self.STRIDE)
+
+        try:
+            other = read_run(otherpath)
+            current = next(other, None)
+            for record in read_run(walkerpath):
+                while current is not None and current[0] < record[0]:
+                    current = next(other, None)
+                if (current is not None and current[0] == record[0]) == keep:
+                    writer.write(record)
+        finally:
+            view = writer.close()
+
+        return view
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import math
+import bisect
 import pygame
 import modules.rgb as rgb
 
@@ -7,7 +9,7 @@ import pygame.freetype
 pygame.freetype.init()
 
 from enum import IntEnum
-from typing import Callable, Any
+from typing import Callable, Any, Sequence
 from dataclasses import dataclass
 
 LinesType = tuple[list[str], list[tuple[int, int]]]
@@ -26,6 +28,33 @@ class RobotoMono(pygame.freetype.Font):
     def get_chars_per_line(rect_width: float, size: float) -> int:
         return round(rect_width / RobotoMono.advance(size))
 
+    # Index of the first word of every line, the same greedy wrapping as always but only looking at lengths
+    @staticmethod
+    def breaks(lengths: list[int], charsperline: int) -> list[int]:
+
+        starts: list[int] = [0]
+        width = 0
+
+        for i, length in enumerate(lengths):
+            if i == starts[-1]:
+                width = length
+            elif width + 1 + length <= charsperline:
+                width += 1 + length
+            else:
+                starts.append(i)
+                width = length
+
+        return starts
+
+    @staticmethod
+    def join_lines(words: list[str], starts: list[int]) -> list[str]:
+        return [' '.join(words[start:end]) for start, end in zip(starts, starts[1:] + [len(words)])]
+
+    @staticmethod
+    def wrap(parr: str, charsperline: int) -> list[str]:
+        words = parr.split()
+        return RobotoMono.join_lines(words, RobotoMono.breaks([len(word) for word in words], charsperline))
+
     @staticmethod
     def split(text: str, size: float, rect_width: float, start: int = 0) -> LinesType:
 
@@ -34,32 +63,85 @@ class RobotoMono(pygame.freetype.Font):
         lines: list[str] = []
         data_result: list[tuple[int, int]] = []
 
-        parrs = text.split('\n')
-        parrs = parrs[start:]
+        for parr in text.split('\n')[start:]:
+            wrapped = RobotoMono.wrap(parr, charsperline)
+            data_result.append((len(lines), len(lines) + len(wrapped) - 1))
+            lines.extend(wrapped)
 
-        for parr in parrs:
+        return lines, data_result
 
-            lines.append("")
-            start_idx = len(lines) - 1
+# TODO: Change everything related to RobotoMono
+FONT = RobotoMono("roboto/static/RobotoMono-Regular.ttf")
 
-            words = parr.split()
+# Every glyph is rasterized once per (size, color) into a single surface
+# Lines are drawn by blitting glyph areas of that surface at fixed advances, RobotoMono being monospaced
+class GlyphAtlas:
 
-            for word in words:
-                prev_word = lines[-1]
-                if len(prev_word) == 0:
-                    lines[-1] = word
-                elif len(prev_word) + 1 + len(word) <= charsperline:
-                    lines[-1] += ' ' + word
-                else:
-                    lines.append(word)
+    BASELINE_REFERENCE = "l"
 
-            end_idx = len(lines) - 1
-            data_result.append((start_idx, end_idx))
+    def __init__(self, font: RobotoMono, size: float, color: rgb.Rgb) -> None:
 
-        return lines, data_result
+        self.font = font
+        self.size = size
+        self.color = color
+        self.advance = font.advance(size)
 
-# TODO: Change everything related to RobotoMono
-FONT = RobotoMono("roboto/static/RobotoMono-Regular.ttf")
+        # Lines used to be blitted with their tallest glyph touching the top, this keeps them roughly where they were
+        _, reference = font.render(self.BASELINE_REFERENCE, color, size = size)
+        self.baseline = reference.y
+
+        self.surface = pygame.Surface((1, 1), pygame.SRCALPHA)
+        self.glyphs: dict[str, tuple[tuple[int, int], tuple[int, int, int, int]]] = {}
+
+    def add(self, chars: set[str]) -> None:
+
+        rendered: list[tuple[str, pygame.Surface, pygame.Rect]] = []
+        for char in chars:
+            surf, rect = self.font.render(char, self.color, size = self.size)
+            rendered.append((char, surf, rect))
+
+        width = self.surface.get_width() + sum(surf.get_width() for _, surf, _ in rendered)
+        height = max([self.surface.get_height()] + [surf.get_height() for _, surf, _ in rendered])
+
+        surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        surface.blit(self.surface, (0, 0))
+
+        x = self.surface.get_width()
+        for char, surf, rect in rendered:
+            surface.blit(surf, (x, 0))
+            self.glyphs[char] = ((rect.x, self.baseline - rect.y), (x, 0, surf.get_width(), surf.get_height()))
+            x += surf.get_width()
+
+        self.surface = surface
+
+    def draw_lines(self, screen: pygame.Surface, lines: list[str], rects: list[Rect]) -> None:
+
+        missing = {char for line in lines for char in line if char not in self.glyphs and not char.isspace()}
+        if len(missing) > 0:
+            self.add(missing)
+
+        glyphs = self.glyphs
+        surface = self.surface
+        advance = self.advance
+        blits: list[tuple[pygame.Surface, tuple[int, int], tuple[int, int, int, int]]] = []
+
+        for line, rect in zip(lines, rects):
+            x, y = int(rect.x), int(rect.y)
+            for i, char in enumerate(line):
+                glyph = glyphs.get(char)
+                if glyph is not None:
+                    (dx, dy), area = glyph
+                    blits.append((surface, (x + i * advance + dx, y + dy), area))
+
+        screen.blits(blits, doreturn = False)
+
+ATLASES: dict[tuple[float, rgb.Rgb], GlyphAtlas] = {}
+
+def get_atlas(size: float, color: rgb.Rgb) -> GlyphAtlas:
+    atlas = ATLASES.get((size, color))
+    if atlas is None:
+        atlas = ATLASES[(size, color)] = GlyphAtlas(FONT, size, color)
+    return atlas
 
 class TextPos(IntEnum):
     NORTHWEST = 0
@@ -98,6 +180,7 @@ class Rect:
 class TextBox:
 
     TEXT_RECT_DEFLATION_FACTOR = 0.05
+    WRAP_CACHE_WIDTHS = 8
     SCROLLBAR_WIDTH_REDUCTION_FACTOR = TEXT_RECT_DEFLATION_FACTOR * 0.5 * 0.5
 
     def __init__(
@@ -120,7 +203,8 @@ class TextBox:
         self.isscrollable = isscrollable
 
         self._rect = rect
-        self._text = text
+        self._text: str | None = text
+        self._parrs = text.split('\n')
         self._size = size
         self._textpos = textpos
         self._start = start
@@ -133,6 +217,12 @@ class TextBox:
         self._sw: int | None = None
         self._sh: int | None = None
 
+        # Words of each laid out paragraph with their lengths, split once. Both caches are keyed by the paragraph itself,
+        # so inserting paragraphs never moves their entries
+        self._words: dict[str, tuple[list[str], list[int]]] = {}
+        # Wrapped lines of each laid out paragraph for the last few characters per line, so resizing back and forth doesn't wrap again
+        self._wrapped: dict[int, dict[str, list[str]]] = {}
+
         self._cached: dict[str, LinesType | list[Rect] | int | None] = {
             "lines": None,
             "line-rects": None,
@@ -145,6 +235,10 @@ class TextBox:
         for key in self._cached.keys():
             self._cached[key] = None
 
+    def reset_wrapped(self) -> None:
+        self._words = {}
+        self._wrapped = {}
+
     def set_screen_size(self, screen: pygame.Surface) -> None:
         sw, sh = screen.get_size()
         if sw != self._sw or sh != self._sh:
@@ -163,6 +257,8 @@ class TextBox:
 
     @property
     def text(self) -> str:
+        if self._text is None:
+            self._text = "\n".join(self._parrs)
         return self._text
 
     @text.setter
@@ -170,6 +266,125 @@ class TextBox:
         self.start = 0
         self.reset_cached()
         self._text = text
+        self._parrs = text.split('\n')
+        self.reset_wrapped()
+
+    # Any sequence works, only the paragraphs that end up on screen are read
+    @property
+    def parrs(self) -> Sequence[str]:
+        return self._parrs
+
+    @parrs.setter
+    def parrs(self, parrs: Sequence[str]) -> None:
+        self.start = 0
+        self.reset_cached()
+        self._text = None
+        self._parrs = parrs
+        self.reset_wrapped()
+
+    @property
+    def nparrs(self) -> int:
+        return len(self._parrs)
+
+    def get_parr(self, i: int) -> str:
+        return self._parrs[i]
+
+    # Only the inserted paragraph is wrapped, its lines are spliced into the laid out ones and everything after it just
+    # moves down. The scroll position stays on the same paragraph
+    def insert_parr(self, i: int, parr: str) -> None:
+
+        assert isinstance(self._parrs, list)
+        self._parrs.insert(i, parr)
+        self._text = None
+
+        # Above the first laid out paragraph nothing on screen changes
+        if i < self._start:
+            self._start += 1
+            return
+
+        self.splice_parr(i, False)
+
+    # Same as inserting, the new lines just take the place of the old ones
+    def set_parr(self, i: int, parr: str) -> None:
+
+        assert isinstance(self._parrs, list)
+        old = self._parrs[i]
+        if old == parr:
+            return
+
+        self._parrs[i] = parr
+        self._words.pop(old, None)
+        for wrapped in self._wrapped.values():
+            wrapped.pop(old, None)
+        self._text = None
+
+        if i >= self._start:
+            self.splice_parr(i, True)
+
+    # Wraps paragraph i and puts its lines in the laid out ones, over its old lines when it's replaced
+    def splice_parr(self, i: int, replaced: bool) -> None:
+
+        if self._cached["lines"] is None:
+            return
+
+        assert isinstance(self._cached["lines"], tuple)
+        assert self._sw is not None and self._sh is not None
+        lines, data = self._cached["lines"]
+        maxlines = self.get_maxlines()
+
+        # Below the last laid out paragraph neither, unless the layout ended with the paragraphs
+        k = i - self._start
+        if k > len(data) or (k == len(data) and (replaced or len(lines) >= maxlines)):
+            return
+
+        first = data[k][0] if k < len(data) else len(lines)
+        m = data[k][1] - data[k][0] + 1 if replaced else 0
+        wrapped = self.wrap_parr(i, FONT.get_chars_per_line(self.rect.w * self._sw, self.size))
+        n = len(wrapped)
+
+        # A shorter paragraph can make room for ones that weren't laid out, those are laid out from scratch
+        if n < m and len(lines) - m + n < maxlines and self._start + len(data) < len(self._parrs):
+            self.reset_cached()
+            return
+
+        lines[first:first+m] = wrapped
+        data[k:] = [(first, first + n - 1)] + [(start + n - m, end + n - m) for start, end in data[k+int(replaced):]]
+
+        # Paragraphs pushed past the bottom of the rect aren't laid out anymore
+        kept = bisect.bisect_left(data, maxlines, key = lambda lines: lines[0])
+        del data[kept:]
+        del lines[data[-1][1] + 1 if kept > 0 else 0:]
+
+        assert len(TextPos) == 2
+
+        # Centered text moves as a whole when it changes size, its rects are computed again
+        if self.textpos == TextPos.CENTERED:
+            for key in ("line-rects", "parr-rects", "line-frames", "parr-frames"):
+                self._cached[key] = None
+            return
+
+        advance = FONT.advance(self.size)
+        base = self.rect.scaled(self._sw, self._sh).deflated(self.TEXT_RECT_DEFLATION_FACTOR, self.TEXT_RECT_DEFLATION_FACTOR)
+        dy = (n - m) * self.size
+
+        def splice(key: str, at: int, removed: int, new: list[Rect], keep: int) -> None:
+            rects = self._cached[key]
+            if rects is None:
+                return
+            assert isinstance(rects, list)
+            if dy != 0:
+                for rect in rects[at+removed:]:
+                    rect.y += dy
+            rects[at:at+removed] = new
+            del rects[keep:]
+
+        line_frames = [Rect(base.x, base.y + (first + j) * self.size, base.w, self.size) for j in range(n)]
+        parr_frame = Rect(base.x, base.y + first * self.size, base.w, n * self.size)
+
+        splice("line-frames", first, m, line_frames, len(lines))
+        splice("line-rects", first, m, [Rect(frame.x, frame.y, len(line) * advance, frame.h) for frame, line in zip(line_frames, wrapped)], len(lines))
+        splice("parr-frames", k, int(replaced), [parr_frame], len(data))
+        splice("parr-rects", k, int(replaced), [Rect(parr_frame.x, parr_frame.y, max(len(line) for line in wrapped) * advance, parr_frame.h)], len(data))
 
     @property
     def size(self) -> float:
@@ -203,13 +418,13 @@ class TextBox:
         if not self.isscrollable:
             return
 
-        _, parrs = self.get_lines(screen)
+        self.set_screen_size(screen)
         assert self._sw is not None and self._sh is not None
 
         if not self.rect.scaled(self._sw, self._sh).collides_with(mouseX, mouseY):
             return
 
-        total_parrs = self.start + len(parrs)
+        total_parrs = self.nparrs
 
         if self.start + delta_start < 0:
             self.start = 0
@@ -221,13 +436,54 @@ class TextBox:
 
         self.start += delta_start
 
+    # Top aligned text is only laid out down to the bottom of the rect
+    def get_maxlines(self) -> float:
+        assert self._sh is not None
+        return math.inf if self.textpos == TextPos.CENTERED else int(self.rect.h * self._sh / self.size) + 1
+
+    def wrap_parr(self, i: int, charsperline: int) -> list[str]:
+
+        parr = self._parrs[i]
+        wrapped_parrs = self._wrapped.setdefault(charsperline, {})
+        wrapped = wrapped_parrs.get(parr)
+
+        if wrapped is None:
+            words = self._words.get(parr)
+            if words is None:
+                split = parr.split()
+                words = self._words[parr] = split, [len(word) for word in split]
+            wrapped = wrapped_parrs[parr] = FONT.join_lines(words[0], FONT.breaks(words[1], charsperline))
+
+        return wrapped
+
     def get_lines(self, screen: pygame.Surface) -> LinesType:
 
         self.set_screen_size(screen)
         assert self._sw is not None and self._sh is not None
 
         if self._cached["lines"] is None:
-            self._cached["lines"] = FONT.split(self.text, self.size, self.rect.w * self._sw, self.start)
+
+            charsperline = FONT.get_chars_per_line(self.rect.w * self._sw, self.size)
+            wrapped_parrs = self._wrapped.pop(charsperline, None)
+            if wrapped_parrs is None:
+                wrapped_parrs = {}
+                while len(self._wrapped) >= self.WRAP_CACHE_WIDTHS:
+                    del self._wrapped[next(iter(self._wrapped))]
+            self._wrapped[charsperline] = wrapped_parrs
+
+            maxlines = self.get_maxlines()
+
+            lines: list[str] = []
+            data: list[tuple[int, int]] = []
+
+            for i in range(self.start, len(self._parrs)):
+                if len(lines) >= maxlines:
+                    break
+                wrapped = self.wrap_parr(i, charsperline)
+                data.append((len(lines), len(lines) + len(wrapped) - 1))
+                lines.extend(wrapped)
+
+            self._cached["lines"] = lines, data
 
         assert isinstance(self._cached["lines"], tuple)
         return self._cached["lines"]
@@ -297,6 +553,17 @@ class TextBox:
         assert isinstance(self._cached["parr-frames"], list)
         return self._cached["parr-frames"]
 
+    # Frames are sorted by y, so the clicked one is found with a binary search
+    def get_parr_at(self, mouseX: int, mouseY: int, screen: pygame.Surface) -> int | None:
+
+        frames = self.get_parr_frames(screen)
+
+        i = bisect.bisect_right(frames, mouseY, key = lambda frame: frame.y) - 1
+        if i >= 0 and frames[i].collides_with(mouseX, mouseY):
+            return i
+
+        return None
+
     def get_line_rects(self, screen: pygame.Surface) -> list[Rect]:
 
         assert len(TextPos) == 2
@@ -359,14 +626,14 @@ class TextBox:
 
     def get_scrollbar(self, screen: pygame.Surface) -> tuple[Rect, Rect]:
 
-        _, parrs = self.get_lines(screen)
+        self.set_screen_size(screen)
         assert self._sw is not None and self._sh is not None
 
         rect = self.rect.scaled(self._sw, self._sh).deflated(0, self.TEXT_RECT_DEFLATION_FACTOR)
         width = min(rect.w * self.TEXT_RECT_DEFLATION_FACTOR / 4, 2)
         x = rect.x + rect.w - 3 / 2 * width
 
-        total_parrs = self.start + len(parrs)
+        total_parrs = max(1, self.nparrs)
         y = rect.y + self.start / total_parrs * rect.h
         h = max(1, rect.h / total_parrs)
 
@@ -392,9 +659,7 @@ class TextBox:
             pygame.draw.rect(screen, self.scrollbarcolor, bar.totuple())
             pygame.draw.rect(screen, rgb.comp(self.scrollbarcolor), mark.totuple())
 
-        for line, rect in zip(lines, rects):
-            surf, _ = FONT.render(line, self.textcolor, size = self.size)
-            screen.blit(surf, rect.totuple())
+        get_atlas(self.size, self.textcolor).draw_lines(screen, lines, rects)
 
 class Button(TextBox):
 
@@ -411,7 +676,8 @@ class Button(TextBox):
             isscrollable: bool = False,
             isvisible: bool = True,
             callback: Callable[[Any], Any] | None = None,
-            parrcallback: Callable[[int, Any], Any] | None = None
+            parrcallback: Callable[[int, Any], Any] | None = None,
+            altparrcallback: Callable[[int, Any], Any] | None = None,
         ) -> None:
 
             super().__init__(
@@ -429,6 +695,7 @@ class Button(TextBox):
 
             self.callback: Callable[[Any], Any] | None = callback
             self.parrcallback: Callable[[int, Any], Any] | None = parrcallback
+            self.altparrcallback: Callable[[int, Any], Any] | None = altparrcallback
 
     def click(self, normalizedMouseX: float, normalizedMouseY: float, args: Any) -> tuple[bool, Any]:
 
@@ -440,20 +707,26 @@ class Button(TextBox):
 
         return False, None
 
-    def click_parr(self, mouseX: int, mouseY: int, screen: pygame.Surface, args: Any) -> tuple[bool, Any]:
+    def click_parr(self, mouseX: int, mouseY: int, screen: pygame.Surface, args: Any, alt: bool = False) -> tuple[bool, Any]:
 
         if not self.isvisible:
             return False, None
 
-        if self.parrcallback is None:
+        callback = self.altparrcallback if alt else self.parrcallback
+        if callback is None:
             return False, None
 
-        frames = self.get_parr_frames(screen)
-        for i, frame in enumerate(frames):
-            if frame.collides_with(mouseX, mouseY):
-                return True, self.parrcallback(i, args)
+        # Clicks outside the button don't need its text laid out
+        self.set_screen_size(screen)
+        assert self._sw is not None and self._sh is not None
+        if not self.rect.scaled(self._sw, self._sh).collides_with(mouseX, mouseY):
+            return False, None
 
-        return False, None
+        i = self.get_parr_at(mouseX, mouseY, screen)
+        if i is None:
+            return False, None
+
+        return True, callback(i, args)
 
 @dataclass
 class Scene:
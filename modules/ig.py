@@ -1,10 +1,20 @@
 from __future__ import annotations
 
 import os
+import re
+import html
+import bisect
+import hashlib
+import calendar
 
+from array import array
 from pathlib import Path
+from typing import Callable, Any, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
+from datetime import datetime
 from html.parser import HTMLParser
+from modules.frontcoded import FrontCodedStrings, bisect_strings
 
 class Unreachable(RuntimeError):
     ...
@@ -12,22 +22,104 @@ class Unreachable(RuntimeError):
 class InvalidInstagramDir(Exception):
     ...
 
+class DirNotFound(LookupError):
+    ...
+
 class Target(IntEnum):
     FOLLOWING = 0
     FOLLOWERS = 1
 
+FOLLOW_DATE_FORMATS = (
+    "%b %d, %Y %I:%M %p",
+    "%b %d, %Y, %I:%M %p",
+    "%b %d, %Y %H:%M",
+    "%b %d, %Y",
+)
+
+NO_TIMESTAMP = -1
+FINGERPRINT_CHUNK_SIZE = 1 << 20
+# The href of a link the way UsersExtractor reads it: tag and attribute in any case, any whitespace, quoted or not
+HREF = re.compile(rb"""<a\s[^>]*?(?<![\w-])href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+
+def parse_follow_date(text: str) -> int | None:
+
+    text = text.strip()
+    if len(text) == 0 or not text[-1].isalnum():
+        return None
+
+    for fmt in FOLLOW_DATE_FORMATS:
+        try:
+            return calendar.timegm(datetime.strptime(text, fmt).timetuple())
+        except ValueError:
+            ...
+
+    return None
+
 class UsersExtractor(HTMLParser):
 
     def __init__(self):
         super().__init__()
         self.users: dict[str, str] = {}
+        self.timestamps: dict[str, int] = {}
+        self._pending: str | None = None
+        self._inanchor = False
 
     def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]):
         if tag == "a":
+            self._inanchor = True
             for attr, userlink in attrs:
                 if attr == "href" and userlink is not None:
                     username = userlink[userlink.rfind('/')+1:]
                     self.users[username] = userlink
+                    self._pending = username
+
+    def handle_endtag(self, tag: str):
+        if tag == "a":
+            self._inanchor = False
+
+    # The date each follow happened is the first text after the anchor, skipping its own text and blanks
+    # Any other text means the user has no date, so it can't be given to the next one
+    def handle_data(self, data: str):
+
+        if self._pending is None or self._inanchor or data.strip() == "":
+            return
+
+        timestamp = parse_follow_date(data)
+        if timestamp is not None:
+            self.timestamps[self._pending] = timestamp
+        self._pending = None
+
+# The usernames UsersExtractor would find, counted on the raw bytes while they're fingerprinted, without parsing the HTML
+# Fed the chunks of one file after another, users in more than one page are counted once
+class UsersCounter:
+
+    def __init__(self) -> None:
+        self.usernames: set[bytes] = set()
+        self._carry = b""
+
+    def feed(self, chunk: bytes) -> None:
+
+        data = self._carry + chunk
+
+        # A tag cut by the end of the chunk is read with the next one
+        cut = data.rfind(b"<")
+        if cut == -1 or data.find(b">", cut) != -1:
+            cut = len(data)
+
+        for doublequoted, singlequoted, unquoted in HREF.findall(data, 0, cut):
+            userlink = doublequoted or singlequoted or unquoted
+            if b"&" in userlink:
+                userlink = html.unescape(userlink.decode("utf-8", "replace")).encode()
+            self.usernames.add(userlink[userlink.rfind(b"/")+1:])
+
+        self._carry = data[cut:]
+
+    # Whatever is left of a file is an unfinished tag
+    def close(self) -> None:
+        self._carry = b""
+
+    def __len__(self) -> int:
+        return len(self.usernames)
 
 class Date:
 
@@ -48,18 +140,126 @@ class Date:
     def __gt__(self, other: Date) -> bool:
         return (self.year, self.month, self.day) > (other.year, other.month, other.day)
 
+    def timestamp(self) -> int:
+        return calendar.timegm((self.year, self.month, self.day, 0, 0, 0))
+
+    @staticmethod
+    def fromstr(text: str) -> Date:
+        date = datetime.strptime(text, "%Y-%m-%d")
+        return Date(date.year, date.month, date.day)
+
+class Connections:
+
+    def __init__(self, users: dict[str, str], timestamps: dict[str, int]) -> None:
+
+        # Kept front coded: neighbouring usernames, and their urls even more, mostly repeat each other
+        usernames = sorted(users.keys())
+        self.usernames: Sequence[str] = FrontCodedStrings(usernames)
+        self.urls: Sequence[str] = FrontCodedStrings([users[username] for username in usernames])
+        self.stamps = array('q', (timestamps.get(username, NO_TIMESTAMP) for username in usernames))
+
+        # Chronological order of the users whose follow date is known
+        timeline = sorted((i for i, stamp in enumerate(self.stamps) if stamp != NO_TIMESTAMP), key = lambda i: self.stamps[i])
+        self.timeline = array('I', timeline)
+        self.timestamps = array('q', (self.stamps[i] for i in timeline))
+
+        self._permutations: dict[str, tuple[int, array[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.usernames)
+
+    def __contains__(self, username: object) -> bool:
+        return isinstance(username, str) and self.index_of(username) is not None
+
+    def __iter__(self):
+        return iter(self.usernames)
+
+    # Views keeping a parse past the call that got it hold it until they're done, see SharedSnapshot
+    # Plain parses are just collected once nothing references them
+    def acquire(self) -> Connections:
+        return self
+
+    def release(self) -> None:
+        ...
+
+    def index_of(self, username: str) -> int | None:
+        i = bisect_strings(self.usernames, username)
+        if i < len(self.usernames) and self.usernames[i] == username:
+            return i
+        return None
+
+    def url(self, username: str) -> str | None:
+        i = self.index_of(username)
+        return None if i is None else self.urls[i]
+
+    def followed_at(self, username: str) -> int | None:
+        i = self.index_of(username)
+        return None if i is None or self.stamps[i] == NO_TIMESTAMP else self.stamps[i]
+
+    # Indices of the users followed in [start, end], both days included, oldest follow first
+    def rows_between(self, start: Date, end: Date) -> array[int]:
+        lo = bisect.bisect_left(self.timestamps, start.timestamp())
+        hi = bisect.bisect_left(self.timestamps, end.timestamp() + 24 * 60 * 60)
+        return self.timeline[lo:hi]
+
+    def between(self, start: Date, end: Date) -> list[str]:
+        return [self.usernames[i] for i in self.rows_between(start, end)]
+
+    def by_recency(self) -> list[str]:
+        return [self.usernames[i] for i in reversed(self.timeline)]
+
+    # Orderings of the users as indices into usernames, computed once per name and version
+    def permutation(self, name: str, version: int, key: Callable[[int], Any]) -> array[int]:
+        cached = self._permutations.get(name)
+        if cached is None or cached[0] != version:
+            cached = self._permutations[name] = (version, array('I', sorted(range(len(self.usernames)), key = key)))
+        return cached[1]
+
+# Name, size and modification time of every file the targets are parsed from
+Signature = tuple[tuple[str, int, int], ...]
+
+# What's known about an export without parsing it: the signature of its files, their fingerprints,
+# and how many users each target holds, counted as anchors while hashing
+class Summary:
+
+    def __init__(self, signature: Signature, fingerprints: dict[Target, str], counts: dict[Target, int]) -> None:
+        self.signature = signature
+        self.fingerprints = fingerprints
+        self.counts = counts
+
+    def pages(self) -> int:
+        return sum(1 for name, _, _ in self.signature if target_of_file(name) == Target.FOLLOWERS)
+
+    def size(self, target: Target) -> int:
+        return sum(size for name, size, _ in self.signature if target_of_file(name) == target)
+
+def combine_fingerprints(fingerprints: dict[Target, str]) -> str:
+    return hashlib.blake2b("".join(fingerprints[target] for target in Target).encode(), digest_size = 16).hexdigest()
+
 class InstagramDir:
 
-    def __init__(self, dirpath: str) -> None:
+    # Whether there are export files at path, which anyone knowing it can parse, even another process
+    isfolder = True
+
+    # known is the summary of an earlier validation, reused while the files keep its signature
+    def __init__(self, dirpath: str, known: Summary | None = None) -> None:
         self.path = dirpath
         self.date = self.ensure_valid_name()
         self.ensure_valid_tree()
+        signature = get_signature(self.path)
+        self.summary = known if known is not None and known.signature == signature else self.get_summary(signature)
+        self.signature = self.summary.signature
+        self.fingerprints = self.summary.fingerprints
+        self.fingerprint = combine_fingerprints(self.fingerprints)
 
     def __eq__(self, other: object) -> bool:
         if isinstance(other, InstagramDir):
             return (self.username, self.date, self.uuid) == (other.username, other.date, other.uuid)
         return False
 
+    def extract(self, target: Target) -> Connections:
+        return extract_connections_from(self.path, target)
+
     def ensure_valid_name(self) -> Date:
 
         stem = Path(self.path).stem
@@ -113,11 +313,124 @@ class InstagramDir:
         if not os.path.exists(followers) or not os.path.isfile(followers):
             raise InvalidInstagramDir(f"Couldn't find file 'followers_1.html'\n{followers}")
 
+    # Hash of the files each target is parsed from, so exports holding the same data are spotted before parsing them
+    # Users are counted on the same pass, so knowing how many there are never takes a parse
+    def get_summary(self, signature: Signature) -> Summary:
+
+        assert len(Target) == 2
+
+        fingerprints: dict[Target, str] = {}
+        counts: dict[Target, int] = {}
+
+        try:
+            for target in Target:
+                hasher = hashlib.blake2b(digest_size = 16)
+                counter = UsersCounter()
+                for filepath in get_target_files(self.path, target):
+                    with open(filepath, "rb") as f:
+                        while chunk := f.read(FINGERPRINT_CHUNK_SIZE):
+                            hasher.update(chunk)
+                            counter.feed(chunk)
+                    counter.close()
+                fingerprints[target] = hasher.hexdigest()
+                counts[target] = len(counter)
+        except OSError as e:
+            raise InvalidInstagramDir(f"Couldn't read {e.filename}")
+
+        return Summary(signature, fingerprints, counts)
+
+# Every export folder under path, not descending into the ones found
+# If there are none, path itself is returned so validating it reports why it's not an export
+def discover_instagram_dirs(path: str) -> list[str]:
+
+    if Path(path).name.startswith("instagram-") or not os.path.isdir(path):
+        return [path]
+
+    found: list[str] = []
+    for root, dirnames, _ in os.walk(path):
+        exports = [dirname for dirname in dirnames if dirname.startswith("instagram-")]
+        found.extend(os.path.join(root, dirname) for dirname in sorted(exports))
+        dirnames[:] = [dirname for dirname in dirnames if not dirname.startswith("instagram-")]
+
+    return found if len(found) > 0 else [path]
+
+def try_instagram_dir(path: str, known: Callable[[str], Summary | None] | None = None) -> InstagramDir | InvalidInstagramDir:
+    try:
+        return InstagramDir(path, None if known is None else known(path))
+    except InvalidInstagramDir as e:
+        return e
+
+# Validation is pure stat work, so it runs fine on threads
+# known gives the summary of a path validated before, if there's one
+def validate_many(paths: list[str], workers: int | None = None, known: Callable[[str], Summary | None] | None = None) -> list[InstagramDir | InvalidInstagramDir]:
+
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        discovered = [path for found in pool.map(discover_instagram_dirs, paths) for path in found]
+        if len(discovered) == 1:
+            return [try_instagram_dir(discovered[0], known)]
+        return list(pool.map(lambda path: try_instagram_dir(path, known), discovered))
+
+# spec is USERNAME@DATE with an optional #UUID, DATE being a full date or a prefix of it like 2026-09
+def find_dir(dirs: list[InstagramDir], spec: str) -> InstagramDir:
+
+    username, _, rest = spec.partition('@')
+    datestr, _, uuid = rest.partition('#')
+
+    found = [folder for folder in dirs if folder.username == username and folder.date.str.startswith(datestr) and (uuid == "" or folder.uuid == uuid)]
+
+    if len(found) == 0:
+        raise DirNotFound(f"No loaded folder matches '{spec}'")
+    if len(found) > 1:
+        raise DirNotFound(f"'{spec}' matches {len(found)} folders: " + ", ".join(f"{folder.username}@{folder.date.str}#{folder.uuid}" for folder in found))
+
+    return found[0]
+
+def get_target_files(instagram_dir: str, target: Target) -> list[str]:
+
+    assert len(Target) == 2
+
+    followers_and_following = os.path.join(instagram_dir, "connections", "followers_and_following")
+
+    if target == Target.FOLLOWING:
+        return [os.path.join(followers_and_following, "following.html")]
+
+    if target == Target.FOLLOWERS:
+        files: list[str] = []
+        while os.path.isfile(filepath := os.path.join(followers_and_following, f"followers_{len(files)+1}.html")):
+            files.append(filepath)
+        return files
+
+    raise Unreachable()
+
+def target_of_file(name: str) -> Target:
+    return Target.FOLLOWING if name == "following.html" else Target.FOLLOWERS
+
+def get_signature(instagram_dir: str) -> Signature:
+
+    signature: list[tuple[str, int, int]] = []
+
+    try:
+        for target in Target:
+            for filepath in get_target_files(instagram_dir, target):
+                st = os.stat(filepath)
+                signature.append((os.path.basename(filepath), st.st_size, st.st_mtime_ns))
+    except OSError as e:
+        raise InvalidInstagramDir(f"Couldn't read {e.filename}")
+
+    return tuple(signature)
+
 def file_get_contents(filepath: str, mode: str = 'r', encoding: str | None = None) -> str:
     with open(filepath, mode = mode, encoding = encoding) as f:
         return f.read()
 
-def extract_from(instagram_dir: str, target: Target) -> dict[str, str]:
+# A file that isn't text or isn't HTML makes the whole export invalid, like a missing one does when validating
+def feed_from(instagram_dir: str, target: Target) -> UsersExtractor:
+    try:
+        return feed_files(instagram_dir, target)
+    except ValueError as e:
+        raise InvalidInstagramDir(f"Couldn't parse the {target.name.lower()} of {instagram_dir}\n{e}")
+
+def feed_files(instagram_dir: str, target: Target) -> UsersExtractor:
 
     assert len(Target) == 2
 
@@ -141,7 +454,14 @@ def extract_from(instagram_dir: str, target: Target) -> dict[str, str]:
     else:
         raise Unreachable()
 
-    return parser.users
+    return parser
+
+def extract_from(instagram_dir: str, target: Target) -> dict[str, str]:
+    return feed_from(instagram_dir, target).users
+
+def extract_connections_from(instagram_dir: str, target: Target) -> Connections:
+    parser = feed_from(instagram_dir, target)
+    return Connections(parser.users, parser.timestamps)
 
 if __name__ == "__main__":
     print(f"{__file__}: This is a module")
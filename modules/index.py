@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import threading
+
+from array import array
+from modules.ig import InstagramDir, Target, Connections
+
+Posting = tuple[InstagramDir, Target]
+
+# Maps every username to the (dir, target) pairs it appears in, filled as exports are parsed
+# Each pair gets a small integer id so a posting list is a flat array of ids
+class UserIndex:
+
+    def __init__(self) -> None:
+
+        self._lock = threading.Lock()
+
+        # Bumped on every change, so orderings built from the counts know when to be rebuilt
+        self.version = 0
+
+        self._postings: list[Posting] = []
+        self._ids: dict[tuple[str, Target], int] = {}
+        self._users: dict[str, array[int]] = {}
+
+        # _buckets[target][k] holds the users found in exactly k snapshots of that target
+        self._counts: dict[Target, dict[str, int]] = {target: {} for target in Target}
+        self._buckets: dict[Target, list[set[str]]] = {target: [set()] for target in Target}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def has(self, instagram_dir: InstagramDir, target: Target) -> bool:
+        with self._lock:
+            return (instagram_dir.path, target) in self._ids
+
+    def add(self, instagram_dir: InstagramDir, target: Target, connections: Connections) -> None:
+
+        with self._lock:
+
+            key = (instagram_dir.path, target)
+            if key in self._ids:
+                return
+
+            self.version += 1
+            postingid = len(self._postings)
+            self._ids[key] = postingid
+            self._postings.append((instagram_dir, target))
+
+            counts = self._counts[target]
+            buckets = self._buckets[target]
+
+            for username in connections.usernames:
+
+                postings = self._users.get(username)
+                if postings is None:
+                    postings = self._users[username] = array('I')
+                postings.append(postingid)
+
+                count = counts.get(username, 0)
+                if count > 0:
+                    buckets[count].discard(username)
+                if count + 1 == len(buckets):
+                    buckets.append(set())
+                buckets[count + 1].add(username)
+                counts[username] = count + 1
+
+    def history(self, username: str) -> list[Posting]:
+        with self._lock:
+            postings = self._users.get(username)
+            return [] if postings is None else [self._postings[postingid] for postingid in postings]
+
+    def nsnapshots(self, usernames: list[str]) -> list[int]:
+        with self._lock:
+            return [len(self._users.get(username, ())) for username in usernames]
+
+    def count(self, username: str, target: Target) -> int:
+        with self._lock:
+            return self._counts[target].get(username, 0)
+
+    # In no particular order, so nothing is sorted for callers that only count or filter them. The ones showing them sort them
+    def present_in_at_least(self, k: int, target: Target) -> list[str]:
+        with self._lock:
+            buckets = self._buckets[target]
+            return [username for bucket in buckets[max(k, 1):] for username in bucket]
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from modules.ig import Connections
+from modules.cache import ParseCache
+from modules.views import Method, DiffView
+from modules.shared import SharedSnapshot, PackedStrings, InvalidSnapshot
+from modules.frontcoded import bisect_strings
+
+# Below this many walked users a single merge is faster than handing shards to other processes
+PARALLEL_MIN_USERS = 1 << 17
+# More shards than workers, so a worker that finishes early picks up another one
+SHARDS_PER_WORKER = 4
+
+# Where a worker process finds a snapshot without copying it: the name of its shared memory or the file it's mapped from
+Location = tuple[str, str]
+
+def locate(connections: Connections) -> Location | None:
+    if isinstance(connections, SharedSnapshot):
+        if connections.name is not None:
+            return "shm", connections.name
+        if connections.path is not None:
+            return "file", connections.path
+    return None
+
+# The workers use the app's resource tracker (see ParseCache.set_workers), which already tracks every shared memory name
+# once: attaching here adds nothing to it, and the worker only closes what it attached. The app stays the one unlinking it
+def open_located(location: Location) -> SharedSnapshot:
+    kind, where = location
+    return SharedSnapshot.from_file(where) if kind == "file" else SharedSnapshot.attach(where)
+
+# Runs in a worker process: rows of walker[ws:we] against other[lo:hi], the only part of other those usernames can be in
+def diff_shard(walker_at: Location, other_at: Location, keep: bool, ws: int, we: int, lo: int, hi: int) -> bytes:
+
+    walker = open_located(walker_at)
+    other = open_located(other_at)
+
+    try:
+        assert isinstance(walker.usernames, PackedStrings) and isinstance(other.usernames, PackedStrings)
+        theirs = set(other.usernames.tolist(lo, hi))
+        rows = array('I', (w for w, username in enumerate(walker.usernames.tolist(ws, we), ws) if (username in theirs) == keep))
+    finally:
+        walker.close()
+        other.close()
+
+    return rows.tobytes()
+
+# Every row of the diff, computed across the workers. Both sides are sorted, so the walked usernames are cut into
+# contiguous ranges and each one only needs the slice of the other side between its first and last username
+# The shards come back in username order and are just concatenated
+def parallel_rows(pool: ProcessPoolExecutor, workers: int, a: Connections, b: Connections, method: Method) -> array[int] | None:
+
+    walker, other = (a, b) if method == Method.AX else (b, a)
+    walker_at, other_at = locate(walker), locate(other)
+
+    if walker_at is None or other_at is None or len(walker) < PARALLEL_MIN_USERS:
+        return None
+
+    # Nothing to walk, and no username to cut the other side at
+    if len(walker) == 0:
+        return array('I')
+
+    nshards = workers * SHARDS_PER_WORKER
+    bounds = [len(walker) * i // nshards for i in range(nshards + 1)]
+    cuts = [0] + [bisect_strings(other.usernames, walker.usernames[w]) for w in bounds[1:-1]] + [len(other)]
+
+    try:
+        futures = [
+            pool.submit(diff_shard, walker_at, other_at, method == Method.AA, bounds[i], bounds[i+1], cuts[i], cuts[i+1])
+            for i in range(nshards) if bounds[i] < bounds[i+1]
+        ]
+        rows = array('I')
+        for future in futures:
+            rows.frombytes(future.result())
+    except (OSError, InvalidSnapshot, BrokenProcessPool):
+        # The snapshot was evicted meanwhile or the pool is gone, the caller merges on its own
+        return None
+
+    return rows
+
+def get_diff(cache: ParseCache, a: Connections, b: Connections, method: Method) -> DiffView:
+    rows = None if cache.processes is None else parallel_rows(cache.processes, cache.workers, a, b, method)
+    return DiffView(a, b, method, rows)
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
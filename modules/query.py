@@ -0,0 +1,369 @@
+from __future__ import annotations
+
+import re
+import threading
+
+from typing import Sequence, Iterator, overload
+from collections import OrderedDict
+from modules.cache import ParseCache
+from modules.ig import InstagramDir, Target, find_dir
+from modules.frontcoded import Cursor
+
+# Set expressions over loaded exports, with Python's operators and precedence ('-' before '&' before '|'):
+#   (acme@2026-09.followers - acme@2026-10.followers) & rival@2026-10.following
+# Operands are USERNAME@DATE[#UUID].followers or .following, DATE being a full date or a prefix of it
+TOKEN = re.compile(r"\s*(?:(?P<operand>[\w.]+@[\w#-]*\.(?:followers|following))\b|(?P<op>[-&|()]))")
+RESULT_CACHE_ENTRIES = 32
+
+Rows = tuple[Sequence[str], Sequence[str]]
+
+class InvalidQuery(Exception):
+    ...
+
+class Operand:
+
+    def __init__(self, spec: str, target: Target) -> None:
+        self.spec = spec
+        self.target = target
+
+class Expr:
+
+    def __init__(self, op: str, args: list[Operand | Expr]) -> None:
+        self.op = op
+        self.args = args
+
+def tokenize(text: str) -> list[str]:
+
+    tokens: list[str] = []
+    pos = 0
+
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match is None:
+            if text[pos:].strip() == "":
+                break
+            raise InvalidQuery(f"Can't read '{text[pos:].strip()}'")
+        tokens.append(match.group("operand") or match.group("op"))
+        pos = match.end()
+
+    return tokens
+
+# Recursive descent, one method per precedence level
+class Parser:
+
+    def __init__(self, text: str) -> None:
+        self.tokens = tokenize(text)
+        self.i = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def advance(self) -> str:
+        token = self.tokens[self.i]
+        self.i += 1
+        return token
+
+    def parse(self) -> Operand | Expr:
+
+        if len(self.tokens) == 0:
+            raise InvalidQuery("The query is empty")
+
+        node = self.union()
+        if self.peek() is not None:
+            raise InvalidQuery(f"Unexpected '{self.peek()}'")
+
+        return node
+
+    def union(self) -> Operand | Expr:
+        node = self.intersection()
+        while self.peek() == '|':
+            self.advance()
+            node = Expr('|', [node, self.intersection()])
+        return node
+
+    def intersection(self) -> Operand | Expr:
+        node = self.difference()
+        while self.peek() == '&':
+            self.advance()
+            node = Expr('&', [node, self.difference()])
+        return node
+
+    def difference(self) -> Operand | Expr:
+        node = self.atom()
+        while self.peek() == '-':
+            self.advance()
+            node = Expr('-', [node, self.atom()])
+        return node
+
+    def atom(self) -> Operand | Expr:
+
+        token = self.peek()
+        if token is None:
+            raise InvalidQuery("The query ends too early")
+
+        self.advance()
+
+        if token == '(':
+            node = self.union()
+            if self.peek() != ')':
+                raise InvalidQuery("Missing ')'")
+            self.advance()
+            return node
+
+        if token in "-&|)":
+            raise InvalidQuery(f"Unexpected '{token}'")
+
+        spec, _, target = token.rpartition('.')
+        return Operand(spec, Target[target.upper()])
+
+# Nodes of a plan. key identifies the result whatever the order of the operands, estimate is an upper bound of its size
+# A leaf holds its parse (see ParseCache.get): a query of a single list shows the parse itself
+class Leaf:
+
+    def __init__(self, folder: InstagramDir, target: Target, cache: ParseCache) -> None:
+        self.folder = folder
+        self.target = target
+        self.connections = cache.get(folder, target, acquire = True)
+        self.key: tuple[object, ...] = ("leaf", folder.fingerprints[target], target)
+        self.estimate = len(self.connections)
+
+    def explain(self) -> str:
+        return f"{self.folder.username}@{self.folder.date.str}.{self.target.name.lower()}"
+
+    def leaves(self) -> list[Leaf]:
+        return [self]
+
+class And:
+
+    def __init__(self, children: list[Plan]) -> None:
+        # Smallest first: every intersection is at most as big as its smallest operand
+        self.children = sorted(children, key = lambda x: x.estimate)
+        self.key: tuple[object, ...] = ('&', tuple(sorted(child.key for child in children)))
+        self.estimate = self.children[0].estimate
+
+    def explain(self) -> str:
+        return "(" + " & ".join(child.explain() for child in self.children) + ")"
+
+    def leaves(self) -> list[Leaf]:
+        return [leaf for child in self.children for leaf in child.leaves()]
+
+class Or:
+
+    def __init__(self, children: list[Plan]) -> None:
+        # Merging the small ones first keeps the intermediate unions small
+        self.children = sorted(children, key = lambda x: x.estimate)
+        self.key: tuple[object, ...] = ('|', tuple(sorted(child.key for child in children)))
+        self.estimate = sum(child.estimate for child in children)
+
+    def explain(self) -> str:
+        return "(" + " | ".join(child.explain() for child in self.children) + ")"
+
+    def leaves(self) -> list[Leaf]:
+        return [leaf for child in self.children for leaf in child.leaves()]
+
+class Diff:
+
+    def __init__(self, base: Plan, subtrahends: list[Plan]) -> None:
+        self.base = base
+        self.subtrahends = subtrahends
+        self.key: tuple[object, ...] = ('-', base.key, tuple(sorted(sub.key for sub in subtrahends)))
+        self.estimate = base.estimate
+
+    def explain(self) -> str:
+        return "(" + " - ".join([self.base.explain()] + [sub.explain() for sub in self.subtrahends]) + ")"
+
+    def leaves(self) -> list[Leaf]:
+        return self.base.leaves() + [leaf for sub in self.subtrahends for leaf in sub.leaves()]
+
+Plan = Leaf | And | Or | Diff
+
+# Merges of sorted usernames, searching the other side with a cursor so small inputs never walk big ones
+def intersect(a: Rows, b: Rows) -> Rows:
+
+    usernames: list[str] = []
+    urls: list[str] = []
+    other = Cursor(b[0])
+
+    for i, username in enumerate(a[0]):
+        if other.seek(username):
+            usernames.append(username)
+            urls.append(a[1][i])
+        elif other.pos == len(b[0]):
+            break
+
+    return usernames, urls
+
+def subtract(a: Rows, b: Rows) -> Rows:
+
+    usernames: list[str] = []
+    urls: list[str] = []
+    other = Cursor(b[0])
+
+    for i, username in enumerate(a[0]):
+        if not other.seek(username):
+            usernames.append(username)
+            urls.append(a[1][i])
+
+    return usernames, urls
+
+def union(a: Rows, b: Rows) -> Rows:
+
+    usernames: list[str] = []
+    urls: list[str] = []
+    x, y = Cursor(a[0]), Cursor(b[0])
+    i = j = 0
+
+    while i < len(a[0]) and j < len(b[0]):
+        left, right = x.get(i), y.get(j)
+        if left < right:
+            usernames.append(left)
+            urls.append(a[1][i])
+            i += 1
+        elif right < left:
+            usernames.append(right)
+            urls.append(b[1][j])
+            j += 1
+        else:
+            usernames.append(left)
+            urls.append(a[1][i])
+            i += 1
+            j += 1
+
+    usernames.extend(a[0][i:])
+    urls.extend(a[1][i:])
+    usernames.extend(b[0][j:])
+    urls.extend(b[1][j:])
+
+    return usernames, urls
+
+class QueryResult:
+
+    def __init__(self, text: str, plan: Plan, rows: Rows) -> None:
+        self.text = text
+        self.plan = plan
+        self.usernames, self.urls = rows
+
+    def __len__(self) -> int:
+        return len(self.usernames)
+
+    @overload
+    def __getitem__(self, k: int) -> str: ...
+    @overload
+    def __getitem__(self, k: slice) -> list[str]: ...
+    def __getitem__(self, k: int | slice) -> str | list[str]:
+        if isinstance(k, slice):
+            return list(self.usernames[k])
+        return self.usernames[k]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.usernames)
+
+    def url(self, k: int) -> str:
+        return self.urls[k]
+
+    def release(self) -> None:
+        release_leaves(self.plan.leaves())
+
+def release_leaves(leaves: list[Leaf]) -> None:
+    for leaf in leaves:
+        leaf.connections.release()
+
+class QueryEngine:
+
+    def __init__(self, cache: ParseCache) -> None:
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._results: OrderedDict[tuple[object, ...], Rows] = OrderedDict()
+
+    # The parses of its leaves are held until the plan, or the result made from it, is released
+    def plan(self, text: str, dirs: list[InstagramDir]) -> Plan:
+
+        leaves: list[Leaf] = []
+
+        try:
+            return self.optimize(Parser(text).parse(), dirs, leaves)
+        except BaseException:
+            release_leaves(leaves)
+            raise
+
+    def run(self, text: str, dirs: list[InstagramDir]) -> QueryResult:
+
+        plan = self.plan(text, dirs)
+
+        try:
+            rows = self.execute(plan)
+        except BaseException:
+            release_leaves(plan.leaves())
+            raise
+
+        return QueryResult(text, plan, rows)
+
+    # Flattens chains of the same operator, folds subtractions into one base minus everything subtracted from it
+    # and pushes intersections under subtractions: (X - Y) & Z becomes (X & Z) - Y, which never walks all of X
+    # Every leaf made is added to leaves
+    def optimize(self, node: Operand | Expr, dirs: list[InstagramDir], leaves: list[Leaf]) -> Plan:
+
+        if isinstance(node, Operand):
+            leaf = Leaf(find_dir(dirs, node.spec), node.target, self.cache)
+            leaves.append(leaf)
+            return leaf
+
+        args = [self.optimize(arg, dirs, leaves) for arg in node.args]
+
+        if node.op == '-':
+            base, sub = args
+            if isinstance(base, Diff):
+                return Diff(base.base, base.subtrahends + [sub])
+            return Diff(base, [sub])
+
+        if node.op == '|':
+            return Or([child for arg in args for child in (arg.children if isinstance(arg, Or) else [arg])])
+
+        if node.op == '&':
+            children = [child for arg in args for child in (arg.children if isinstance(arg, And) else [arg])]
+            diffs = [child for child in children if isinstance(child, Diff)]
+            if len(diffs) == 0:
+                return And(children)
+            rest = [child for child in children if not isinstance(child, Diff)] + [diff.base for diff in diffs]
+            bases = [child for base in rest for child in (base.children if isinstance(base, And) else [base])]
+            return Diff(And(bases), [sub for diff in diffs for sub in diff.subtrahends])
+
+        raise InvalidQuery(f"Unknown operator '{node.op}'")
+
+    def execute(self, plan: Plan) -> Rows:
+
+        if isinstance(plan, Leaf):
+            return plan.connections.usernames, plan.connections.urls
+
+        with self._lock:
+            rows = self._results.get(plan.key)
+            if rows is not None:
+                self._results.move_to_end(plan.key)
+                return rows
+
+        if isinstance(plan, And):
+            rows = self.execute(plan.children[0])
+            for child in plan.children[1:]:
+                if len(rows[0]) == 0:
+                    break
+                rows = intersect(rows, self.execute(child))
+        elif isinstance(plan, Or):
+            rows = self.execute(plan.children[0])
+            for child in plan.children[1:]:
+                rows = union(rows, self.execute(child))
+        else:
+            rows = self.execute(plan.base)
+            for sub in plan.subtrahends:
+                if len(rows[0]) == 0:
+                    break
+                rows = subtract(rows, self.execute(sub))
+
+        with self._lock:
+            self._results[plan.key] = rows
+            while len(self._results) > RESULT_CACHE_ENTRIES:
+                self._results.popitem(last = False)
+
+        return rows
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
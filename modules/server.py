@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import json
+import asyncio
+import threading
+
+from typing import Callable, Any, Iterator, Sequence
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qsl
+from modules.cache import ParseCache
+from modules.index import UserIndex
+from modules.views import Method, DiffView
+from modules.query import QueryEngine, QueryResult, InvalidQuery
+from modules.parallel import get_diff
+from modules.ig import InstagramDir, Target, Date, Connections, DirNotFound, InvalidInstagramDir, find_dir
+
+HOST = "127.0.0.1"
+ALLOWED_HOSTS = ("127.0.0.1", "localhost", "[::1]")
+MAX_REQUEST_SIZE = 16 * 1024
+CACHE_ENTRIES = 64
+CACHE_MAX_BODY = 1 << 20
+STREAM_CHUNK_ROWS = 4096
+
+class QueryError(Exception):
+
+    def __init__(self, status: int, msg: str) -> None:
+        super().__init__(msg)
+        self.status = status
+
+# A list of users in JSON, produced row by row so big ones can be streamed
+class UsersResult:
+
+    def __init__(self, view: DiffView | QueryResult | PickedView, offset: int, limit: int | None, extra: dict[str, Any]) -> None:
+        self.view = view
+        self.offset = offset
+        self.stop = len(view) if limit is None else min(len(view), offset + limit)
+        self.extra = extra
+
+    def __len__(self) -> int:
+        return max(0, self.stop - self.offset)
+
+    def release(self) -> None:
+        self.view.release()
+
+    def chunks(self) -> Iterator[bytes]:
+
+        head = {"count": len(self.view), "offset": self.offset, **self.extra}
+        yield (json.dumps(head)[:-1] + ', "users": [').encode()
+
+        rows: list[str] = []
+        for k in range(self.offset, self.stop):
+            rows.append(json.dumps({"username": self.view[k], "url": self.view.url(k)}))
+            if len(rows) == STREAM_CHUNK_ROWS:
+                yield (("" if k + 1 - len(rows) == self.offset else ", ") + ", ".join(rows)).encode()
+                rows = []
+        if len(rows) > 0:
+            yield (("" if self.stop - len(rows) == self.offset else ", ") + ", ".join(rows)).encode()
+
+        yield b"]}"
+
+# Users of a snapshot picked by their index, like the ones followed in a period. It holds the snapshot like DiffView
+class PickedView:
+
+    def __init__(self, connections: Connections, rows: Sequence[int]) -> None:
+        self.connections = connections
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, k: int) -> str:
+        return self.connections.usernames[self.rows[k]]
+
+    def url(self, k: int) -> str:
+        return self.connections.urls[self.rows[k]]
+
+    def release(self) -> None:
+        self.connections.release()
+
+# Answers queries over the loaded folders, keeping their parses warm in the cache
+# Kept apart from the sockets so it can be used and tested without any networking
+class QueryService:
+
+    def __init__(self, get_dirs: Callable[[], list[InstagramDir]], cache: ParseCache, index: UserIndex | None = None) -> None:
+        self.get_dirs = get_dirs
+        self.cache = cache
+        self.index = index
+        self.queries = QueryEngine(cache)
+
+    def query(self, route: str, params: dict[str, str]) -> dict[str, Any] | UsersResult:
+
+        try:
+            if route == "/dirs":
+                return {"dirs": [describe_dir(folder) for folder in self.get_dirs()]}
+            if route == "/compare":
+                return self.compare(params)
+            if route == "/changes":
+                return self.changes(params)
+            if route == "/history":
+                return self.history(params)
+            if route == "/query":
+                return UsersResult(self.queries.run(params["q"], self.get_dirs()), *get_page(params), {"query": params["q"]})
+        except DirNotFound as e:
+            raise QueryError(404, e.args[0])
+        except FileNotFoundError as e:
+            raise QueryError(410, f"Couldn't find {e.filename}, the folder was renamed, moved or deleted")
+        except InvalidInstagramDir as e:
+            raise QueryError(404, e.args[0])
+        except OSError as e:
+            raise QueryError(500, f"Couldn't read the folder: {e}")
+        except InvalidQuery as e:
+            raise QueryError(400, e.args[0])
+        except (KeyError, ValueError) as e:
+            raise QueryError(400, f"Invalid query: {e}")
+
+        raise QueryError(404, f"Unknown route {route}")
+
+    # Same comparisons as the GUI, b defaults to a, comparing its followers with its following
+    def compare(self, params: dict[str, str]) -> UsersResult:
+
+        dirs = self.get_dirs()
+        a = find_dir(dirs, params["a"])
+        b = find_dir(dirs, params["b"]) if "b" in params else None
+        target = Target[params.get("target", "followers").upper()]
+        method = Method[params.get("method", "xa").upper()]
+
+        as_target = Target.FOLLOWERS if b is None or target == Target.FOLLOWERS else Target.FOLLOWING
+        bs_target = Target.FOLLOWING if b is None or target == Target.FOLLOWING else Target.FOLLOWERS
+
+        view = get_diff(self.cache, *self.cache.acquire_all([(a, as_target), (a if b is None else b, bs_target)]), method)
+        return UsersResult(view, *get_page(params), {"a": describe_dir(a), "b": describe_dir(a if b is None else b)})
+
+    # Who was lost, gained or kept by account between the first snapshot on or after from and the last one on or before to
+    # Followed is read from the follow dates of its latest snapshot instead, most recent first, so it needs a single one
+    def changes(self, params: dict[str, str]) -> UsersResult:
+
+        account = params["account"]
+        start = Date.fromstr(params["from"])
+        end = Date.fromstr(params["to"])
+        target = Target[params.get("target", "followers").upper()]
+        kind = params.get("kind", "lost")
+
+        if kind == "followed":
+            snapshots = [folder for folder in self.get_dirs() if folder.username == account]
+            if len(snapshots) == 0:
+                raise DirNotFound(f"No loaded folder of {account}")
+            latest = max(snapshots, key = lambda x: x.date)
+            connections = self.cache.get(latest, target, acquire = True)
+            view = PickedView(connections, connections.rows_between(start, end)[::-1])
+            return UsersResult(view, *get_page(params), {"in": describe_dir(latest)})
+
+        method = {"lost": Method.AX, "gained": Method.XA, "kept": Method.AA}[kind]
+
+        snapshots = [folder for folder in self.get_dirs() if folder.username == account and not folder.date < start and not folder.date > end]
+        if len(snapshots) < 2:
+            raise DirNotFound(f"Need two folders of {account} between {start.str} and {end.str}, found {len(snapshots)}")
+
+        first = min(snapshots, key = lambda x: x.date)
+        last = max(snapshots, key = lambda x: x.date)
+
+        view = get_diff(self.cache, *self.cache.acquire_all([(first, target), (last, target)]), method)
+        return UsersResult(view, *get_page(params), {"from": describe_dir(first), "to": describe_dir(last)})
+
+    def history(self, params: dict[str, str]) -> dict[str, Any]:
+
+        if self.index is None:
+            raise QueryError(404, "No user index available")
+
+        username = params["user"]
+        return {"user": username, "history": [{**describe_dir(folder), "target": target.name.lower()} for folder, target in self.index.history(username)]}
+
+    # Only results of folders that didn't change can be reused, so the content fingerprints are part of the key
+    def cache_key(self, route: str, params: dict[str, str]) -> tuple[Any, ...]:
+        return route, tuple(sorted(params.items())), tuple(folder.fingerprint for folder in self.get_dirs())
+
+def describe_dir(folder: InstagramDir) -> dict[str, str | int]:
+    return {"spec": f"{folder.username}@{folder.date.str}#{folder.uuid}", "username": folder.username, "date": folder.date.str, "uuid": folder.uuid, "path": folder.path,
+            "followers": folder.summary.counts[Target.FOLLOWERS], "following": folder.summary.counts[Target.FOLLOWING]}
+
+def get_page(params: dict[str, str]) -> tuple[int, int | None]:
+    offset = int(params.get("offset", "0"))
+    limit = int(params["limit"]) if "limit" in params else None
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit can't be negative")
+    return offset, limit
+
+# Minimal HTTP/1.1 over asyncio: GET only, one request per connection, bound to localhost
+class QueryServer:
+
+    def __init__(self, service: QueryService, port: int = 0) -> None:
+        self.service = service
+        self.port = port
+        self.responses: OrderedDict[tuple[Any, ...], tuple[int, bytes]] = OrderedDict()
+        self._server: asyncio.Server | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self.handle, HOST, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    # Runs the server on its own event loop in a daemon thread, next to the GUI
+    def start_in_background(self) -> int:
+
+        started = threading.Event()
+
+        def run() -> None:
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target = run, name = "lcmp-server", daemon = True)
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def stop_in_background(self) -> None:
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+
+        try:
+            try:
+                method, target, headers = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                await send(writer, 400, json.dumps({"error": "Malformed request"}).encode())
+                return
+
+            # Rejects requests for any other host name, so a web page can't reach the server through DNS rebinding
+            if get_hostname(headers.get("host", "")) not in ALLOWED_HOSTS:
+                await send(writer, 403, json.dumps({"error": "Forbidden host"}).encode())
+                return
+
+            if method != "GET":
+                await send(writer, 405, json.dumps({"error": "Only GET is supported"}).encode())
+                return
+
+            url = urlsplit(target)
+            params = dict(parse_qsl(url.query))
+            await self.respond(writer, url.path, params)
+
+        except ConnectionError:
+            ...
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, route: str, params: dict[str, str]) -> None:
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            key = self.service.cache_key(route, params)
+            cached = self.responses.get(key)
+            if cached is not None:
+                self.responses.move_to_end(key)
+                await send(writer, *cached)
+                return
+
+            # Parsing, merging and formatting are CPU bound, they run outside the event loop so other requests keep being served
+            result = await loop.run_in_executor(None, self.service.query, route, params)
+
+            try:
+                if isinstance(result, UsersResult) and len(result) > STREAM_CHUNK_ROWS:
+                    await stream(writer, result.chunks())
+                    return
+                body = await loop.run_in_executor(None, get_body, result)
+            finally:
+                if isinstance(result, UsersResult):
+                    result.release()
+
+        except QueryError as e:
+            await send(writer, e.status, json.dumps({"error": e.args[0]}).encode())
+            return
+
+        if len(body) <= CACHE_MAX_BODY:
+            self.responses[key] = (200, body)
+            while len(self.responses) > CACHE_ENTRIES:
+                self.responses.popitem(last = False)
+
+        await send(writer, 200, body)
+
+def get_body(result: dict[str, Any] | UsersResult) -> bytes:
+    return b"".join(result.chunks()) if isinstance(result, UsersResult) else json.dumps(result).encode()
+
+# Host header without its port: 127.0.0.1:8765, localhost or [::1]:8765, whose address has colons of its own
+def get_hostname(host: str) -> str:
+    if host.startswith('['):
+        address, bracket, port = host.partition(']')
+        return address + bracket if port == "" or port.startswith(':') else ""
+    return host.rsplit(':', 1)[0]
+
+async def read_request(reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str]]:
+
+    head = await reader.readuntil(b"\r\n\r\n")
+    if len(head) > MAX_REQUEST_SIZE:
+        raise ValueError("Request too large")
+
+    requestline, *headerlines = head.decode("latin-1").split("\r\n")
+    method, target, _ = requestline.split(' ', 2)
+
+    headers: dict[str, str] = {}
+    for line in headerlines:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    return method, target, headers
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 410: "Gone", 500: "Internal Server Error"}
+
+async def send(writer: asyncio.StreamWriter, status: int, body: bytes) -> None:
+    writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode())
+    writer.write(body)
+    await writer.drain()
+
+# Every chunk is formatted in the executor, the event loop only writes them
+async def stream(writer: asyncio.StreamWriter, chunks: Iterator[bytes]) -> None:
+
+    loop = asyncio.get_running_loop()
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+
+    while (chunk := await loop.run_in_executor(None, next, chunks, None)) is not None:
+        writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        await writer.drain()
+
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
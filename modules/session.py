@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import os
+import json
+import queue
+import threading
+
+from typing import Callable
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from modules.cache import ParseCache, cache_dir
+from modules.ig import InstagramDir, InvalidInstagramDir, Summary, get_signature
+
+SESSION_VERSION = 2
+
+class InvalidSession(Exception):
+    ...
+
+@dataclass
+class Session:
+
+    dirs: list[str] = field(default_factory = list)
+    selected: tuple[str | None, str | None] = (None, None)
+    method: str = "XA"
+    target: str = "FOLLOWERS"
+    order: str = "ALPHABETICAL"
+    scroll: dict[str, int] = field(default_factory = dict)
+
+def session_path() -> str:
+    return os.path.join(cache_dir(), "session.json")
+
+def save_session(session: Session, path: str | None = None) -> None:
+
+    path = session_path() if path is None else path
+    data = {
+        "version": SESSION_VERSION,
+        "dirs": session.dirs,
+        "selected": list(session.selected),
+        "method": session.method,
+        "target": session.target,
+        "order": session.order,
+        "scroll": session.scroll,
+    }
+
+    # Written next to the final path and renamed, so quitting halfway never leaves a broken session behind
+    with open(path + ".tmp", "w", encoding = "utf-8") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+def load_session(path: str | None = None) -> Session | None:
+
+    path = session_path() if path is None else path
+
+    try:
+        with open(path, encoding = "utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        raise InvalidSession(f"Couldn't read the last session\n{e}")
+
+    try:
+        if data["version"] != SESSION_VERSION:
+            return None
+        dirs = [str(path) for path in data["dirs"]]
+        first, second = data["selected"]
+        return Session(dirs, (first, second), data["method"], data["target"], data["order"], dict(data["scroll"]))
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidSession(f"The last session is damaged\n{e}")
+
+# Only stats every file: folders whose summary is known and that kept its signature are back without reading them,
+# the paths of the other ones are returned to be hashed and parsed again in the background
+def restore_dirs(paths: list[str], known: Callable[[str], Summary | None]) -> tuple[list[InstagramDir | InvalidInstagramDir], list[str]]:
+
+    def restore(path: str) -> InstagramDir | InvalidInstagramDir | str:
+        try:
+            summary = known(path)
+            if summary is None or get_signature(path) != summary.signature:
+                return path
+            return InstagramDir(path, summary)
+        except InvalidInstagramDir:
+            return InvalidInstagramDir(f"{path} from the last session was renamed, moved or deleted")
+
+    with ThreadPoolExecutor() as pool:
+        results = list(pool.map(restore, paths))
+
+    return [result for result in results if not isinstance(result, str)], [result for result in results if isinstance(result, str)]
+
+# Folders that changed since the session was saved are hashed and parsed off the UI thread, handed over through events
+def revalidate_in_background(paths: list[str], cache: ParseCache | None, events: queue.Queue[InstagramDir | InvalidInstagramDir]) -> None:
+
+    def run() -> None:
+        for path in paths:
+            try:
+                newdir = InstagramDir(path)
+            except InvalidInstagramDir as e:
+                events.put(e)
+                continue
+            if cache is not None:
+                try:
+                    cache.load(newdir)
+                except InvalidInstagramDir as e:
+                    events.put(e)
+                    continue
+                except OSError:
+                    ...
+            events.put(newdir)
+
+    threading.Thread(target = run, name = "lcmp-revalidate", daemon = True).start()
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
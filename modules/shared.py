@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import mmap
+import struct
+import threading
+
+import modules.ig as ig
+
+from array import array
+from typing import Iterator, overload
+from multiprocessing import shared_memory
+from modules.ig import Target, Connections
+
+# Flat layout of a parsed snapshot, every section 8 byte aligned, all integers little endian:
+#   header
+#   username offsets  (count + 1) x u64, into the username blob
+#   url offsets       (count + 1) x u64, into the url blob
+#   stamps            count x i64, follow timestamp of every user or NO_TIMESTAMP
+#   timeline          ndated x u32 (padded to 8 bytes), users with a follow date in chronological order
+#   timestamps        ndated x i64, their sorted follow timestamps
+#   username blob, url blob
+HEADER = struct.Struct("<8sQQQQ")
+MAGIC = b"LCMPSNP1"
+
+class InvalidSnapshot(Exception):
+    ...
+
+def align(n: int) -> int:
+    return (n + 7) & ~7
+
+def get_layout(count: int, ndated: int, usernames_size: int) -> tuple[int, int, int, int, int, int, int]:
+    username_offsets = HEADER.size
+    url_offsets = username_offsets + 8 * (count + 1)
+    stamps = url_offsets + 8 * (count + 1)
+    timeline = stamps + 8 * count
+    timestamps = timeline + align(4 * ndated)
+    usernames = timestamps + 8 * ndated
+    urls = usernames + usernames_size
+    return username_offsets, url_offsets, stamps, timeline, timestamps, usernames, urls
+
+def encode(strings: list[str]) -> tuple[array[int], bytes]:
+
+    encoded = [string.encode() for string in strings]
+
+    offsets = array('Q', [0])
+    total = 0
+    for blob in encoded:
+        total += len(blob)
+        offsets.append(total)
+
+    return offsets, b"".join(encoded)
+
+class Packed:
+
+    def __init__(self, connections: Connections) -> None:
+
+        username_offsets, usernames = encode(list(connections.usernames))
+        url_offsets, urls = encode(list(connections.urls))
+
+        self.count = len(connections.usernames)
+        self.ndated = len(connections.timeline)
+        self.layout = get_layout(self.count, self.ndated, len(usernames))
+        self.size = self.layout[6] + len(urls)
+        self.sections = (
+            username_offsets.tobytes(),
+            url_offsets.tobytes(),
+            array('q', connections.stamps).tobytes(),
+            array('I', connections.timeline).tobytes(),
+            array('q', connections.timestamps).tobytes(),
+            usernames,
+            urls,
+        )
+
+    def write(self, buf: memoryview) -> None:
+
+        if len(buf) < self.size:
+            raise ValueError(f"Buffer of {len(buf)} bytes can't hold a snapshot of {self.size} bytes")
+
+        HEADER.pack_into(buf, 0, MAGIC, self.count, self.ndated, len(self.sections[5]), len(self.sections[6]))
+        for start, section in zip(self.layout, self.sections):
+            buf[start:start+len(section)] = section
+
+# A sorted list of strings read straight from the buffer, decoded one at a time when indexed
+class PackedStrings:
+
+    def __init__(self, offsets: memoryview, blob: memoryview) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @overload
+    def __getitem__(self, i: int) -> str: ...
+    @overload
+    def __getitem__(self, i: slice) -> list[str]: ...
+    def __getitem__(self, i: int | slice) -> str | list[str]:
+
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        return str(self.blob[self.offsets[i]:self.offsets[i+1]], "utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield str(self.blob[self.offsets[i]:self.offsets[i+1]], "utf-8")
+
+    # Everything in [start, stop) decoded at once, much faster than indexing when all of them are needed
+    def tolist(self, start: int = 0, stop: int | None = None) -> list[str]:
+        stop = len(self) if stop is None else stop
+        offsets = self.offsets[start:stop+1].tolist()
+        if len(offsets) < 2:
+            return []
+        blob = self.blob[offsets[0]:offsets[-1]].tobytes()
+        return [blob[begin-offsets[0]:end-offsets[0]].decode() for begin, end in zip(offsets, offsets[1:])]
+
+# Connections read in place from a flat buffer (shared memory or a mapped file), nothing is copied or unpickled
+class SharedSnapshot(Connections):
+
+    def __init__(self, buf: memoryview, shm: shared_memory.SharedMemory | None = None, mapped: mmap.mmap | None = None) -> None:
+
+        if len(buf) < HEADER.size:
+            raise InvalidSnapshot("Buffer is too small to hold a snapshot")
+
+        magic, count, ndated, usernames_size, urls_size = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise InvalidSnapshot("Buffer doesn't hold a snapshot")
+
+        layout = get_layout(count, ndated, usernames_size)
+        if len(buf) < layout[6] + urls_size:
+            raise InvalidSnapshot("Snapshot is truncated")
+
+        self.shm = shm
+        self.mapped = mapped
+        self.path: str | None = None
+        self.buf = buf
+
+        username_offsets, url_offsets, stamps, timeline, timestamps, usernames, urls = layout
+        self.usernames = PackedStrings(buf[username_offsets:url_offsets].cast('Q'), buf[usernames:urls])
+        self.urls = PackedStrings(buf[url_offsets:stamps].cast('Q'), buf[urls:urls+urls_size])
+        self.stamps = buf[stamps:timeline].cast('q')
+        self.timeline = buf[timeline:timeline+4*ndated].cast('I')
+        self.timestamps = buf[timestamps:usernames].cast('q')
+
+        # Kept apart since usernames or urls may be swapped for decoded lists
+        self._views = (self.usernames.offsets, self.usernames.blob, self.urls.offsets, self.urls.blob, self.stamps, self.timeline, self.timestamps, buf)
+
+        self._permutations = {}
+
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._retired = False
+
+    @staticmethod
+    def create(connections: Connections, name: str | None = None) -> SharedSnapshot:
+        packed = Packed(connections)
+        shm = shared_memory.SharedMemory(name = name, create = True, size = packed.size)
+        packed.write(shm.buf)
+        return SharedSnapshot(shm.buf, shm = shm)
+
+    @staticmethod
+    def attach(name: str) -> SharedSnapshot:
+        shm = shared_memory.SharedMemory(name = name)
+        return SharedSnapshot(shm.buf, shm = shm)
+
+    @staticmethod
+    def write_file(connections: Connections, path: str) -> None:
+        packed = Packed(connections)
+        buf = bytearray(packed.size)
+        packed.write(memoryview(buf))
+        with open(path, "wb") as f:
+            f.write(buf)
+
+    @staticmethod
+    def from_file(path: str) -> SharedSnapshot:
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        snapshot = SharedSnapshot(memoryview(mapped), mapped = mapped)
+        snapshot.path = path
+        return snapshot
+
+    @property
+    def name(self) -> str | None:
+        return None if self.shm is None else self.shm.name
+
+    def close(self) -> None:
+        for view in self._views:
+            view.release()
+        if self.shm is not None:
+            self.shm.close()
+        if self.mapped is not None:
+            self.mapped.close()
+
+    # Its views must be released before SharedMemory's own finalizer tries to close the mapping under them
+    # Not there when __init__ found no snapshot in the buffer
+    def __del__(self) -> None:
+        if hasattr(self, "_views"):
+            self.close()
+
+    def unlink(self) -> None:
+        if self.shm is not None:
+            self.shm.unlink()
+
+    def acquire(self) -> SharedSnapshot:
+        with self._lock:
+            self._readers += 1
+        return self
+
+    def release(self) -> None:
+        with self._lock:
+            self._readers -= 1
+            closing = self._readers == 0 and self._retired
+        if closing:
+            self.close()
+
+    # Dropped by the cache: its name goes away right away, and its memory with the last view holding it
+    # Held by none, whoever is still reading it just got it from the cache, and it's unmapped once they're done with it
+    def retire(self) -> None:
+        self.unlink()
+        with self._lock:
+            self._retired = True
+
+# Runs in a worker process: the parsed snapshot is left in shared memory and only its name goes back
+def parse_to_shared(instagram_dir: str, target: Target) -> str:
+
+    snapshot = SharedSnapshot.create(ig.extract_connections_from(instagram_dir, target))
+    name = snapshot.name
+    assert name is not None
+
+    # Left registered: the resource tracker is the app's one (see ParseCache.set_workers), not the worker's
+    snapshot.close()
+    return name
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import os
+import json
+import threading
+
+from modules.cache import cache_dir
+from modules.ig import InstagramDir, Summary, Target
+
+SUMMARIES_VERSION = 2
+
+# Summaries of every export validated before, by path, so validating it again while its files keep
+# their signature reads nothing, and counts of hundreds of exports are known without parsing any
+class SummaryIndex:
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._summaries: dict[str, Summary] = {}
+
+    def get_path(self) -> str:
+        return os.path.join(cache_dir(), "summaries.json") if self.path is None else self.path
+
+    # A missing or damaged index is just started again
+    def load(self) -> None:
+
+        try:
+            with open(self.get_path(), encoding = "utf-8") as f:
+                data = json.load(f)
+            if data["version"] != SUMMARIES_VERSION:
+                return
+            summaries = {
+                path: Summary(
+                    tuple(tuple(entry) for entry in saved["signature"]),
+                    {Target[name]: fingerprint for name, fingerprint in saved["fingerprints"].items()},
+                    {Target[name]: count for name, count in saved["counts"].items()},
+                )
+                for path, saved in data["summaries"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+
+        with self._lock:
+            self._summaries.update(summaries)
+
+    # Folders that don't exist anymore are forgotten
+    def save(self) -> None:
+
+        with self._lock:
+            summaries = {path: summary for path, summary in self._summaries.items() if os.path.isdir(path)}
+
+        data = {
+            "version": SUMMARIES_VERSION,
+            "summaries": {
+                path: {
+                    "signature": summary.signature,
+                    "fingerprints": {target.name: fingerprint for target, fingerprint in summary.fingerprints.items()},
+                    "counts": {target.name: count for target, count in summary.counts.items()},
+                }
+                for path, summary in summaries.items()
+            },
+        }
+
+        path = self.get_path()
+        with open(path + ".tmp", "w", encoding = "utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    def get(self, path: str) -> Summary | None:
+        with self._lock:
+            return self._summaries.get(os.path.abspath(path))
+
+    def put(self, folder: InstagramDir) -> None:
+        with self._lock:
+            self._summaries[os.path.abspath(folder.path)] = folder.summary
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
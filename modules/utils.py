@@ -1,10 +1,20 @@
 from __future__ import annotations
 
+import queue
+
 import modules.rgb as rgb
 
 from enum import IntEnum
-from modules.ig import InstagramDir, Target
+from modules.ig import InstagramDir, Target, InvalidInstagramDir, Connections
 from modules.gui import Scene, TextBox, TextPos, Rect
+from modules.cache import ParseCache
+from modules.index import UserIndex
+from modules.views import Method, Order, DiffView, UsersView
+from modules.watcher import FolderWatcher
+from modules.external import OutOfCore, RunView
+from modules.server import QueryServer
+from modules.query import QueryEngine, QueryResult
+from modules.summary import SummaryIndex
 
 class Unreachable(RuntimeError):
     ...
@@ -14,27 +24,38 @@ class ErrorType(IntEnum):
     WARNING = 1
     ERROR = 2
 
-class Method(IntEnum):
-
-    XA = 0
-    AX = 1
-    AA = 2
-
-    def next(self) -> Method:
-        return Method((self + 1) % len(Method))
-
 class State:
 
     scenes: dict[str, Scene] = {}
     scenename: str = ""
 
     dirs: list[InstagramDir] = []
+    fingerprints: dict[str, InstagramDir] = {}
     selected: tuple[int, int] | tuple[int, None] | tuple[None, None] = (None, None)
 
     method = Method.XA
     target = Target.FOLLOWERS
+    order = Order.ALPHABETICAL
 
-    users: dict[str, str] = {}
+    diff: DiffView | RunView | QueryResult | None = None
+    users: UsersView | RunView | QueryResult | None = None
+
+    # typing is the query being written after pressing '/', query the one whose result is displayed
+    typing: str | None = None
+    query: str | None = None
+
+    index = UserIndex()
+    cache = ParseCache(index.add)
+    queries = QueryEngine(cache)
+    watcher: FolderWatcher | None = None
+    outofcore: OutOfCore | None = None
+    server: QueryServer | None = None
+    revalidated: queue.Queue[InstagramDir | InvalidInstagramDir] = queue.Queue()
+    annotated: queue.Queue[tuple[DiffView, list[Connections] | OSError | InvalidInstagramDir]] = queue.Queue()
+    summaries = SummaryIndex()
+
+    dropped: list[str] = []
+    dropping: bool = False
 
     uppressed: bool = False
     downpressed: bool = False
@@ -62,5 +83,37 @@ def should_add_uuid(i: int, dirs: list[InstagramDir]) -> bool:
 def get_uuid_if_needed(i: int, dirs: list[InstagramDir]) -> str:
     return "" if not should_add_uuid(i, dirs) else f"({dirs[i].uuid})"
 
+# The export of the same account right before dirs[i], dirs being in date order
+def get_previous_snapshot(i: int, dirs: list[InstagramDir]) -> InstagramDir | None:
+    return next((dirs[j] for j in range(i - 1, -1, -1) if dirs[j].username == dirs[i].username), None)
+
+# Short enough for the folder list: 9876, 12.3k, 1.2M
+def get_count_str(count: int) -> str:
+
+    n = abs(count)
+    if n < 10_000:
+        text = str(n)
+    elif n < 1_000_000:
+        text = f"{n // 100 / 10:g}k"
+    else:
+        text = f"{n // 100_000 / 10:g}M"
+
+    return f"-{text}" if count < 0 else text
+
+# Counts come from the summaries, so labels never need a parse. Deltas are against the previous export of the same account
+def get_dir_label(i: int, dirs: list[InstagramDir]) -> str:
+
+    folder = dirs[i]
+    previous = get_previous_snapshot(i, dirs)
+    label = f"> {folder.username} {folder.date.str} {get_uuid_if_needed(i, dirs)}"
+
+    for target in (Target.FOLLOWERS, Target.FOLLOWING):
+        count = folder.summary.counts[target]
+        label += f" {get_count_str(count)} {target.name.lower()}"
+        if previous is not None and (delta := count - previous.summary.counts[target]) != 0:
+            label += f" {'+' if delta > 0 else ''}{get_count_str(delta)}"
+
+    return label
+
 if __name__ == "__main__":
     print(f"{__file__}: This is a module")
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+from array import array
+from enum import IntEnum, IntFlag
+from typing import Iterator, overload
+from modules.ig import Connections
+from modules.frontcoded import Cursor, bisect_strings
+
+class Method(IntEnum):
+
+    XA = 0
+    AX = 1
+    AA = 2
+
+    def next(self) -> Method:
+        return Method((self + 1) % len(Method))
+
+class Order(IntEnum):
+
+    ALPHABETICAL = 0
+    RECENT = 1
+    SNAPSHOTS = 2
+    FOLLOW_BACK = 3
+
+    def next(self) -> Order:
+        return Order((self + 1) % len(Order))
+
+# How a listed user relates to the account being looked at, and whether it's in the other selected export
+class Relation(IntFlag):
+
+    FOLLOWS_YOU = 1
+    YOU_FOLLOW = 2
+    IN_OTHER = 4
+
+# Result of comparing two sorted connections, produced lazily by a linear merge
+# XA: users only in b, AX: users only in a, AA: users in both (urls taken from b)
+class DiffView:
+
+    # rows, when given, are every row already computed elsewhere (see modules.parallel), and nothing is left to merge
+    # a and b are held by the view from now on (see ParseCache.get), release lets go of them
+    def __init__(self, a: Connections, b: Connections, method: Method, rows: array[int] | None = None) -> None:
+
+        assert len(Method) == 3
+
+        self.a = a
+        self.b = b
+        self.method = method
+
+        # The merge walks one side and looks every username up in the other one
+        self.walker, self.other = (a, b) if method == Method.AX else (b, a)
+        self.keep = method == Method.AA
+
+        self._rows = array('I') if rows is None else rows
+        self._w = 0 if rows is None else len(self.walker)
+        self._o = 0 if rows is None else len(self.other)
+        self._count: int | None = None
+        self._ordered: dict[str, tuple[array[int], OrderedView]] = {}
+        self._relations: Relations | None = None
+
+    @property
+    def isdone(self) -> bool:
+        return self._w == len(self.walker)
+
+    def release(self) -> None:
+        self.a.release()
+        self.b.release()
+        if self._relations is not None:
+            self._relations.release()
+            self._relations = None
+
+    # Advances the merge until there are n rows or the inputs run out
+    def fill(self, n: int) -> None:
+
+        walker = Cursor(self.walker.usernames, self._w)
+        other = Cursor(self.other.usernames, self._o)
+        rows = self._rows
+        w = self._w
+
+        while len(rows) < n and w < len(self.walker):
+            if other.seek(walker.get(w)) == self.keep:
+                rows.append(w)
+            w += 1
+
+        self._w, self._o = w, other.pos
+
+    # Counted without materializing the rows, only the size of the intersection is needed: the smaller side is walked
+    # and looked up in the bigger one with a cursor that only moves forward, which skips whole blocks between hits
+    def __len__(self) -> int:
+
+        if self._count is None:
+            if self.isdone:
+                self._count = len(self._rows)
+            else:
+                small, big = sorted((self.a.usernames, self.b.usernames), key = len)
+                cursor = Cursor(big)
+                shared = sum(cursor.seek(username) for username in small)
+                self._count = shared if self.keep else len(self.walker) - shared
+
+        return self._count
+
+    def row(self, k: int) -> int:
+
+        if k < 0:
+            k += len(self)
+
+        self.fill(k + 1)
+        if not 0 <= k < len(self._rows):
+            raise IndexError(k)
+
+        return self._rows[k]
+
+    @overload
+    def __getitem__(self, k: int) -> str: ...
+    @overload
+    def __getitem__(self, k: slice) -> list[str]: ...
+    def __getitem__(self, k: int | slice) -> str | list[str]:
+
+        if isinstance(k, slice):
+            start, stop, step = k.indices(len(self))
+            if step > 0:
+                self.fill(stop)
+            return [self.walker.usernames[self.row(i)] for i in range(start, stop, step)]
+
+        return self.walker.usernames[self.row(k)]
+
+    def __iter__(self) -> Iterator[str]:
+        k = 0
+        while True:
+            self.fill(k + 1)
+            if k == len(self._rows):
+                return
+            yield self.walker.usernames[self._rows[k]]
+            k += 1
+
+    def url(self, k: int) -> str:
+        return self.walker.urls[self.row(k)]
+
+    # permutation orders the walked connections, so the rows in that order are a filter of it and need no sort
+    def ordered(self, name: str, permutation: array[int]) -> OrderedView:
+
+        cached = self._ordered.get(name)
+        if cached is not None and cached[0] is permutation:
+            return cached[1]
+
+        self.fill(len(self.walker))
+
+        positions = array('i', [-1]) * len(self.walker)
+        for k, w in enumerate(self._rows):
+            positions[w] = k
+
+        view = OrderedView(self, array('I', (k for w in permutation if (k := positions[w]) >= 0)))
+        self._ordered[name] = (permutation, view)
+        return view
+
+    # Relation flags of the rows, worked out only as far as they're read (see Relations)
+    # The lists are held like a and b, the relations worked out for the same ones before already hold them
+    def relations(self, followers: Connections, following: Connections, others: list[Connections]) -> Relations:
+
+        lists = [followers, following] + others
+        if self._relations is not None and len(self._relations.lists) == len(lists) and all(x is y for x, y in zip(self._relations.lists, lists)):
+            for connections in lists:
+                connections.release()
+            return self._relations
+
+        if self._relations is not None:
+            self._relations.release()
+
+        self._relations = Relations(self, lists)
+        return self._relations
+
+# Relation flags of the rows of a view, in a merge join advanced lazily like DiffView.fill: rows are flagged in order and
+# every sorted list keeps a cursor that only moves forward, so reading the first rows costs about as much as showing them
+# A row far past the last flagged one (rows of an ordered view jump around) is looked up on its own instead
+class Relations:
+
+    LOOKAHEAD = 1024
+
+    def __init__(self, view: DiffView, lists: list[Connections]) -> None:
+
+        self.view = view
+        self.lists = lists
+
+        # Plain ints, or'ing enum members is much slower
+        self.flags = [int(Relation.FOLLOWS_YOU), int(Relation.YOU_FOLLOW)] + [int(Relation.IN_OTHER)] * (len(lists) - 2)
+
+        self._walker = Cursor(view.walker.usernames)
+        self._cursors = [Cursor(connections.usernames) for connections in lists]
+        self._flagged = array('B')
+        self._looked_up: dict[int, int] = {}
+
+    def release(self) -> None:
+        for connections in self.lists:
+            connections.release()
+
+    def __getitem__(self, k: int) -> int:
+
+        if k < len(self._flagged):
+            return self._flagged[k]
+
+        if k >= len(self._flagged) + self.LOOKAHEAD:
+            relation = self._looked_up.get(k)
+            if relation is None:
+                relation = self._looked_up[k] = self.look_up(k)
+            return relation
+
+        self.extend(k + 1)
+        if k >= len(self._flagged):
+            raise IndexError(k)
+
+        return self._flagged[k]
+
+    # Flags rows until there are n of them or the view runs out
+    def extend(self, n: int) -> None:
+
+        self.view.fill(n)
+        rows = self.view._rows
+        flagged = self._flagged
+        pairs = list(zip(self._cursors, self.flags))
+
+        for k in range(len(flagged), min(n, len(rows))):
+            username = self._walker.get(rows[k])
+            relation = 0
+            for cursor, flag in pairs:
+                if cursor.seek(username):
+                    relation |= flag
+            flagged.append(relation)
+
+    def look_up(self, k: int) -> int:
+
+        username = self.view[k]
+        relation = 0
+
+        for connections, flag in zip(self.lists, self.flags):
+            i = bisect_strings(connections.usernames, username)
+            if i < len(connections.usernames) and connections.usernames[i] == username:
+                relation |= flag
+
+        return relation
+
+class OrderedView:
+
+    def __init__(self, view: DiffView, rows: array[int]) -> None:
+        self.view = view
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @overload
+    def __getitem__(self, k: int) -> str: ...
+    @overload
+    def __getitem__(self, k: slice) -> list[str]: ...
+    def __getitem__(self, k: int | slice) -> str | list[str]:
+        if isinstance(k, slice):
+            return [self.view[row] for row in self.rows[k]]
+        return self.view[self.rows[k]]
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.view[row] for row in self.rows)
+
+    def url(self, k: int) -> str:
+        return self.view.url(self.rows[k])
+
+# Every row followed by its relations, you being the account the lists are about and other the other selected export
+class AnnotatedView:
+
+    def __init__(self, view: DiffView | OrderedView, relations: Relations, you: str, other: str | None) -> None:
+        self.view = view
+        self.relations = relations
+        self.you = you
+        self.other = other
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def describe(self, relation: int) -> str:
+
+        tags: list[str] = []
+
+        if relation & Relation.FOLLOWS_YOU and relation & Relation.YOU_FOLLOW:
+            tags.append(f"mutual with {self.you}")
+        elif relation & Relation.FOLLOWS_YOU:
+            tags.append(f"follows {self.you}")
+        elif relation & Relation.YOU_FOLLOW:
+            tags.append(f"{self.you} follows")
+
+        if relation & Relation.IN_OTHER and self.other is not None:
+            tags.append(f"in {self.other}")
+
+        return " · ".join(tags)
+
+    def annotate(self, k: int) -> str:
+        row = self.view.rows[k] if isinstance(self.view, OrderedView) else k
+        tags = self.describe(self.relations[row])
+        return self.view[k] if tags == "" else f"{self.view[k]} · {tags}"
+
+    @overload
+    def __getitem__(self, k: int) -> str: ...
+    @overload
+    def __getitem__(self, k: slice) -> list[str]: ...
+    def __getitem__(self, k: int | slice) -> str | list[str]:
+        if isinstance(k, slice):
+            return [self.annotate(i) for i in range(*k.indices(len(self)))]
+        return self.annotate(k if k >= 0 else k + len(self))
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.annotate(k) for k in range(len(self)))
+
+    def url(self, k: int) -> str:
+        return self.view.url(k)
+
+UsersView = DiffView | OrderedView | AnnotatedView
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+import sys
+import time
+import queue
+import select
+import ctypes
+import ctypes.util
+import shutil
+import zipfile
+import threading
+
+from typing import Callable
+from modules.ig import InstagramDir, InvalidInstagramDir, Summary
+from modules.cache import ParseCache, cache_dir
+
+Fingerprint = tuple[tuple[str, int, int], ...]
+
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_MASK        = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+class Inotify:
+
+    def __init__(self, paths: list[str]) -> None:
+
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on linux")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        for path in paths:
+            if self._libc.inotify_add_watch(self._fd, os.fsencode(path), IN_MASK) < 0:
+                os.close(self._fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+
+    def wait(self, timeout: float) -> None:
+
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self._fd, 4096):
+                    ...
+            except BlockingIOError:
+                ...
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+# Polls the watched directories for new instagram-* folders or zips and ingests them in the background
+# inotify (when available) only makes the polling wake up as soon as something changes
+class FolderWatcher:
+
+    def __init__(self, paths: list[str], cache: ParseCache | None, interval: float = 2.0, known: Callable[[str], Summary | None] | None = None) -> None:
+
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.cache = cache
+        self.known = known
+        self.interval = interval
+
+        self.events: queue.Queue[InstagramDir | InvalidInstagramDir] = queue.Queue()
+
+        self._seen: dict[str, Fingerprint] = {}
+        self._pending: dict[str, tuple[Fingerprint, float]] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, name = "lcmp-watcher", daemon = True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+
+        try:
+            inotify: Inotify | None = Inotify(self.paths)
+        except (OSError, AttributeError):
+            inotify = None
+
+        try:
+            while not self._stop.is_set():
+                self.scan()
+                if inotify is not None:
+                    inotify.wait(self.interval)
+                else:
+                    self._stop.wait(self.interval)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def scan(self) -> None:
+
+        now = time.monotonic()
+
+        for path in self.paths:
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+
+            for entry in entries:
+                if not entry.name.startswith("instagram-"):
+                    continue
+
+                fingerprint = get_fingerprint(entry)
+                if fingerprint is None or self._seen.get(entry.path) == fingerprint:
+                    continue
+
+                # Only ingest once it stopped changing, so half copied exports are not picked up
+                pending = self._pending.get(entry.path)
+                if pending is None or pending[0] != fingerprint:
+                    self._pending[entry.path] = (fingerprint, now)
+                    continue
+                if now - pending[1] < self.interval:
+                    continue
+
+                del self._pending[entry.path]
+                self._seen[entry.path] = fingerprint
+                self.ingest(entry.path)
+
+    def ingest(self, path: str) -> None:
+
+        try:
+            if path.lower().endswith(".zip"):
+                path = extract_zip(path)
+            newdir = InstagramDir(path, None if self.known is None else self.known(path))
+        except InvalidInstagramDir as e:
+            self.events.put(e)
+            return
+        except (OSError, zipfile.BadZipFile) as e:
+            self.events.put(InvalidInstagramDir(f"Couldn't read {path}\n{e}"))
+            return
+
+        if self.cache is not None:
+            try:
+                self.cache.load(newdir)
+            except InvalidInstagramDir as e:
+                self.events.put(e)
+                return
+            except OSError:
+                ...
+
+        self.events.put(newdir)
+
+def get_fingerprint(entry: os.DirEntry[str]) -> Fingerprint | None:
+
+    try:
+        if entry.is_file():
+            if not entry.name.lower().endswith(".zip"):
+                return None
+            st = entry.stat()
+            return ((entry.name, st.st_size, st.st_mtime_ns),)
+
+        if entry.is_dir():
+            followers_and_following = os.path.join(entry.path, "connections", "followers_and_following")
+            fingerprint: list[tuple[str, int, int]] = []
+            for file in os.scandir(followers_and_following):
+                st = file.stat()
+                fingerprint.append((file.name, st.st_size, st.st_mtime_ns))
+            return tuple(sorted(fingerprint))
+
+    except OSError:
+        ...
+
+    return None
+
+# Only the connections are extracted, into lcmp's cache directory, keeping the export's name
+# What an earlier version of the same zip left there is removed first, so files of both are never mixed
+def extract_zip(zippath: str) -> str:
+
+    stem = os.path.splitext(os.path.basename(zippath))[0]
+    outdir = os.path.join(cache_dir(), "exports", stem)
+    connections = os.path.normpath(os.path.join(outdir, "connections", "followers_and_following"))
+    marker = "connections/followers_and_following/"
+
+    shutil.rmtree(outdir, ignore_errors = True)
+
+    with zipfile.ZipFile(zippath) as archive:
+        for member in archive.namelist():
+            i = member.find(marker)
+            if i == -1 or member.endswith('/'):
+                continue
+            name = member[i+len(marker):]
+            # Names like ../x, ..\x or C:\x would land outside of it, on windows backslashes and drives count too
+            dst = os.path.normpath(os.path.join(connections, name))
+            if os.path.dirname(dst) != connections or os.path.commonpath([connections, dst]) != connections:
+                continue
+            os.makedirs(connections, exist_ok = True)
+            with archive.open(member) as src, open(dst, "wb") as out:
+                while chunk := src.read(1 << 20):
+                    out.write(chunk)
+
+    return outdir
+
+if __name__ == "__main__":
+    print(f"{__file__}: This is a module")
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import modules.ig as ig
+
+from modules.cache import ParseCache
+from modules.archive import InvalidArchive, save_archives, open_archive, find_archives
+from tests.test_server import write_export
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        write_export(self.root, "acme", "2026-09-01", ["ann", "bob", "cat"], ["ann"])
+        write_export(self.root, "acme", "2026-10-01", ["ann", "cat", "dan"], ["ann", "bob"])
+        write_export(self.root, "rival", "2026-10-01", ["eve"], [])
+        self.dirs = [folder for folder in ig.validate_many([self.root]) if isinstance(folder, ig.InstagramDir)]
+        self.cache = ParseCache()
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        shutil.rmtree(self.root, ignore_errors = True)
+
+    def test_snapshots_open_like_the_exports(self) -> None:
+
+        archives = os.path.join(self.root, "archives")
+        paths = save_archives(self.dirs, self.cache, archives)
+        self.assertEqual(find_archives(archives), sorted(paths))
+
+        snapshots = [snapshot for path in find_archives(archives) for snapshot in open_archive(path)]
+        self.assertEqual(len(snapshots), len(self.dirs))
+
+        for snapshot in snapshots:
+            folder = next(folder for folder in self.dirs if folder == snapshot)
+            self.assertEqual(snapshot.fingerprint, folder.fingerprint)
+            self.assertEqual(snapshot.summary.counts, folder.summary.counts)
+            for target in ig.Target:
+                rebuilt, parsed = ParseCache().get(snapshot, target), ig.extract_connections_from(folder.path, target)
+                self.assertEqual(list(rebuilt.usernames), list(parsed.usernames))
+                self.assertEqual(list(rebuilt.urls), list(parsed.urls))
+                self.assertEqual(rebuilt.stamps, parsed.stamps)
+
+        # Archiving what was opened writes the same snapshots back
+        again = save_archives(snapshots, self.cache, os.path.join(self.root, "again"))
+        self.assertEqual([[snapshot.path.rpartition("@")[2] for snapshot in open_archive(path)] for path in sorted(again)],
+                         [[snapshot.path.rpartition("@")[2] for snapshot in open_archive(path)] for path in sorted(paths)])
+
+    def test_invalid(self) -> None:
+        path = os.path.join(self.root, "broken.lcmparc")
+        with open(path, "wb") as f:
+            f.write(b"not an archive")
+        with self.assertRaises(InvalidArchive):
+            open_archive(path)
+        self.assertEqual(find_archives(os.path.join(self.root, "missing")), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import modules.ig as ig
+
+from modules.cache import ParseCache
+from modules.shared import SharedSnapshot
+from modules.views import DiffView, Method
+from tests.test_server import write_export
+
+# Parses mapped from the store are the ones evicting has to unmap, plain ones are just dropped
+class EvictTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+
+        self.root = tempfile.mkdtemp()
+        write_export(self.root, "acme", "2026-09-01", ["ann", "bob", "cat"], ["ann"])
+        write_export(self.root, "acme", "2026-10-01", ["ann", "cat", "dan"], ["ann", "bob"])
+        self.dirs = [folder for folder in ig.validate_many([self.root]) if isinstance(folder, ig.InstagramDir)]
+
+        store = os.path.join(self.root, "store")
+        warm = ParseCache()
+        warm.set_store(store)
+        for folder in self.dirs:
+            warm.load(folder)
+        warm.persist(self.dirs)
+        warm.close()
+
+        self.cache = ParseCache()
+        self.cache.set_store(store)
+        self.cache.set_budget(1)
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        shutil.rmtree(self.root, ignore_errors = True)
+
+    def test_views_keep_evicted_parses(self) -> None:
+
+        a, b = self.cache.acquire_all([(self.dirs[0], ig.Target.FOLLOWERS), (self.dirs[1], ig.Target.FOLLOWERS)])
+        self.assertIsInstance(a, SharedSnapshot)
+        view = DiffView(a, b, Method.XA)
+
+        # Evicted by the parses after it, still read by the view
+        for target in ig.Target:
+            self.cache.get(self.dirs[1], target)
+        self.assertFalse(self.cache.has(self.dirs[0], ig.Target.FOLLOWERS))
+        self.assertEqual(list(view), ["dan"])
+        self.assertEqual(a.urls[0], "https://www.instagram.com/ann")
+
+        # Unmapped with the last view holding it
+        view.release()
+        assert a.mapped is not None
+        self.assertTrue(a.mapped.closed)
+        with self.assertRaises(ValueError):
+            a.urls[0]
+
+    def test_failed_acquire_holds_nothing(self) -> None:
+
+        # Never parsed, and gone from the disk since it was validated
+        missing = ig.InstagramDir(write_export(self.root, "rival", "2026-10-01", ["eve"], ["eve", "ann"]))
+        shutil.rmtree(missing.path)
+
+        with self.assertRaises(OSError):
+            self.cache.acquire_all([(self.dirs[0], ig.Target.FOLLOWING), (missing, ig.Target.FOLLOWING)])
+
+        held = self.cache.get(self.dirs[0], ig.Target.FOLLOWING)
+        assert isinstance(held, SharedSnapshot)
+        self.assertEqual(held._readers, 0)
+
+if __name__ == "__main__":
+    unittest.main()
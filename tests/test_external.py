@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import modules.ig as ig
+
+from modules.views import Method
+from modules.external import OutOfCore
+from tests.test_server import write_export
+
+class OutOfCoreTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        write_export(self.root, "acme", "2026-09-01", ["ann", "bob", "cat"], ["ann"])
+        write_export(self.root, "acme", "2026-10-01", ["ann", "cat", "dan"], ["ann", "bob"])
+        self.dirs = [folder for folder in ig.validate_many([self.root]) if isinstance(folder, ig.InstagramDir)]
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root, ignore_errors = True)
+
+    def test_runs_are_pruned(self) -> None:
+
+        rundir = os.path.join(self.root, "runs")
+        outofcore = OutOfCore(1 << 20, rundir)
+        try:
+            view = outofcore.diff(self.dirs[0], ig.Target.FOLLOWERS, self.dirs[1], ig.Target.FOLLOWERS, Method.XA)
+            self.assertEqual(list(view), ["dan"])
+            self.assertEqual(len(os.listdir(rundir)), 2)
+
+            outofcore.prune(self.dirs[1:])
+            self.assertEqual(os.listdir(rundir), [os.path.basename(outofcore.run_path(self.dirs[1], ig.Target.FOLLOWERS))])
+        finally:
+            outofcore.close()
+
+    def test_temporary_runs(self) -> None:
+        outofcore = OutOfCore(1 << 20)
+        outofcore.diff(self.dirs[0], ig.Target.FOLLOWERS, self.dirs[1], ig.Target.FOLLOWERS, Method.AA)
+        self.assertTrue(outofcore.rundir.startswith(outofcore.tmpdir))
+        outofcore.close()
+        self.assertFalse(os.path.exists(outofcore.tmpdir))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import bisect
+import random
+import unittest
+
+from modules.frontcoded import FrontCodedStrings, Cursor, BLOCK_SIZE, LONG, bisect_strings, window
+
+# Every case is checked against the same strings kept in a plain list
+class FrontCodedTest(unittest.TestCase):
+
+    def check(self, strings: list[str]) -> None:
+
+        coded = FrontCodedStrings(strings)
+
+        self.assertEqual(len(coded), len(strings))
+        self.assertEqual(coded.tolist(), strings)
+        self.assertEqual([coded[i] for i in range(len(strings))], strings)
+        self.assertEqual([coded[-i] for i in range(1, len(strings) + 1)], [strings[-i] for i in range(1, len(strings) + 1)])
+        self.assertEqual(coded[BLOCK_SIZE - 3:2 * BLOCK_SIZE + 3], strings[BLOCK_SIZE - 3:2 * BLOCK_SIZE + 3])
+        with self.assertRaises(IndexError):
+            coded[len(strings)]
+
+        # Every string, and strings falling between them, before them and after them
+        probes = sorted(set(strings + [string + "\0" for string in strings] + [string[:-1] for string in strings] + ["", "\U0010ffff"]))
+        for x in probes:
+            self.assertEqual(bisect_strings(coded, x), bisect.bisect_left(strings, x), x)
+            self.assertEqual(x in coded, x in strings, x)
+        for lo in range(0, len(strings) + 2, 5):
+            self.assertEqual(bisect_strings(coded, strings[-1] if strings else "", lo), bisect.bisect_left(strings, strings[-1] if strings else "", lo))
+
+        # Cursors only move forward, seeking increasing strings and reading increasing indices
+        cursor = Cursor(coded)
+        for x in probes:
+            found = cursor.seek(x)
+            self.assertEqual(cursor.pos, bisect.bisect_left(strings, x), x)
+            self.assertEqual(found, x in strings, x)
+        cursor = Cursor(coded)
+        self.assertEqual([cursor.get(i) for i in range(len(strings))], strings)
+
+        for i in range(0, len(strings), 7):
+            start, decoded = window(coded, i)
+            self.assertEqual(list(decoded), strings[start:start + len(decoded)])
+            self.assertTrue(start <= i < start + len(decoded))
+
+    def test_empty(self) -> None:
+        self.check([])
+        self.assertEqual(window(FrontCodedStrings([]), 0), (0, []))
+
+    def test_block_boundaries(self) -> None:
+        for n in (1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 2 * BLOCK_SIZE, 3 * BLOCK_SIZE + 5):
+            self.check([f"user{i:05d}" for i in range(n)])
+
+    def test_long_prefixes(self) -> None:
+        # Shared prefixes and suffixes longer than a byte can count
+        base = "x" * (LONG + 40)
+        strings = sorted([base + f"{i:03d}" for i in range(2 * BLOCK_SIZE)] + [base[:LONG] + "y" * (LONG + 10), "a" * (LONG + 1)])
+        self.check(strings)
+
+    def test_multibyte(self) -> None:
+        # Shared byte prefixes that end in the middle of a character
+        rng = random.Random(7)
+        alphabet = "aé田èé田由\U0001f600\U0001f601_."
+        strings = sorted({"".join(rng.choice(alphabet) for _ in range(rng.randint(1, 12))) for _ in range(300)})
+        self.check(strings)
+        self.check(sorted(["é" * 200 + "田" * k for k in range(40)]))
+
+if __name__ == "__main__":
+    unittest.main()
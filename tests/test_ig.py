@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import calendar
+import unittest
+
+from modules.ig import UsersExtractor, Connections, Date, parse_follow_date
+
+def stamp(year: int, month: int, day: int, hour: int = 0, minute: int = 0) -> int:
+    return calendar.timegm((year, month, day, hour, minute, 0))
+
+class ParseFollowDateTest(unittest.TestCase):
+
+    def test_accepted(self) -> None:
+        self.assertEqual(parse_follow_date("Sep 01, 2026 10:05 am"), stamp(2026, 9, 1, 10, 5))
+        self.assertEqual(parse_follow_date("Sep 01, 2026 10:05 PM"), stamp(2026, 9, 1, 22, 5))
+        self.assertEqual(parse_follow_date("Mar 3, 2025, 12:00 am"), stamp(2025, 3, 3))
+        self.assertEqual(parse_follow_date("Dec 31, 2024 23:59"), stamp(2024, 12, 31, 23, 59))
+        self.assertEqual(parse_follow_date("  Jan 15, 2023\n"), stamp(2023, 1, 15))
+
+    def test_rejected(self) -> None:
+        for text in ("", "   ", "username", "2026-09-01", "Sep 01, 2026 10:05 am.", "Sep 32, 2026", "Followers"):
+            self.assertIsNone(parse_follow_date(text), text)
+
+class UsersExtractorTest(unittest.TestCase):
+
+    def extract(self, html: str) -> UsersExtractor:
+        parser = UsersExtractor()
+        parser.feed(html)
+        return parser
+
+    def test_dates_follow_their_anchor(self) -> None:
+        parser = self.extract(
+            '<div><a href="https://www.instagram.com/ann">ann</a><div>Sep 01, 2026 10:00 am</div></div>'
+            '<div><a href="https://www.instagram.com/bob">bob</a><div>not a date</div></div>'
+            '<div><a href="https://www.instagram.com/cat">Oct 02, 2026</a></div>'
+            '<div><div>Oct 03, 2026</div></div>'
+        )
+        self.assertEqual(sorted(parser.users), ["ann", "bob", "cat"])
+        # bob's text isn't a date and cat's only date is its own link text, neither gets the next date
+        self.assertEqual(parser.timestamps, {"ann": stamp(2026, 9, 1, 10), "cat": stamp(2026, 10, 3)})
+
+class ConnectionsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        users = {name: f"https://www.instagram.com/{name}" for name in ("ann", "bob", "cat", "dan", "eve")}
+        timestamps = {"ann": stamp(2026, 3, 1), "bob": stamp(2026, 5, 31, 23, 59), "cat": stamp(2026, 6, 1), "eve": stamp(2026, 2, 28)}
+        self.connections = Connections(users, timestamps)
+
+    def test_between(self) -> None:
+        self.assertEqual(self.connections.between(Date(2026, 3, 1), Date(2026, 5, 31)), ["ann", "bob"])
+        self.assertEqual(self.connections.between(Date(2026, 1, 1), Date(2026, 12, 31)), ["eve", "ann", "bob", "cat"])
+        self.assertEqual(self.connections.between(Date(2027, 1, 1), Date(2027, 12, 31)), [])
+
+    def test_by_recency(self) -> None:
+        self.assertEqual(self.connections.by_recency(), ["cat", "bob", "ann", "eve"])
+        self.assertIsNone(self.connections.followed_at("dan"))
+
+if __name__ == "__main__":
+    unittest.main()
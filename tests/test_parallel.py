@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import modules.ig as ig
+
+from unittest import mock
+from concurrent.futures import ProcessPoolExecutor
+from modules.cache import ParseCache
+from modules.shared import SharedSnapshot
+from modules.views import DiffView, Method
+from modules.parallel import parallel_rows, SHARDS_PER_WORKER
+from tests.test_server import write_export
+
+WORKERS = 2
+
+# Parses mapped from a store are located by their file, so the workers read them like they'd read shared memory
+# Every export is tiny, the threshold is lowered so they're still split into shards
+@mock.patch("modules.parallel.PARALLEL_MIN_USERS", 0)
+class ParallelRowsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.pool = ProcessPoolExecutor(max_workers = WORKERS)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.pool.shutdown()
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.caches: list[ParseCache] = []
+
+    def tearDown(self) -> None:
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.root, ignore_errors = True)
+
+    def stored(self, followers: list[str], following: list[str]) -> tuple[SharedSnapshot, SharedSnapshot]:
+
+        folder = ig.InstagramDir(write_export(tempfile.mkdtemp(dir = self.root), "acme", "2026-09-01", followers, following))
+        store = os.path.join(self.root, f"store{len(self.caches)}")
+
+        warm = ParseCache()
+        warm.set_store(store)
+        warm.load(folder)
+        warm.persist([folder])
+        warm.close()
+
+        cache = ParseCache()
+        cache.set_store(store)
+        self.caches.append(cache)
+        a, b = cache.get(folder, ig.Target.FOLLOWERS), cache.get(folder, ig.Target.FOLLOWING)
+        assert isinstance(a, SharedSnapshot) and isinstance(b, SharedSnapshot)
+        return a, b
+
+    def check(self, followers: list[str], following: list[str]) -> None:
+        a, b = self.stored(followers, following)
+        for x, y in ((a, b), (b, a)):
+            for method in Method:
+                rows = parallel_rows(self.pool, WORKERS, x, y, method)
+                assert rows is not None
+                serial = DiffView(x, y, method)
+                serial.fill(len(x) + len(y))
+                self.assertEqual(rows.tolist(), serial._rows.tolist(), method)
+                self.assertEqual(list(DiffView(x, y, method, rows)), list(serial), method)
+
+    def test_random(self) -> None:
+        rng = random.Random(3)
+        everyone = [f"user{i:04d}" for i in range(400)]
+        self.check(rng.sample(everyone, 250), rng.sample(everyone, 180))
+
+    def test_boundaries_in_both(self) -> None:
+        # Every shard starts at a username the other side has too, and the slice cut for it must still include it
+        same = [f"user{i:04d}" for i in range(WORKERS * SHARDS_PER_WORKER * 5)]
+        self.check(same, same)
+        self.check(same, same[::5])
+
+    def test_empty_shards(self) -> None:
+        # Fewer users than shards, one side empty, and shards whose slice of the other side is empty
+        self.check(["ann", "bob", "cat"], ["bob"])
+        self.check([f"user{i:04d}" for i in range(50)], [])
+        self.check([f"user{i:04d}" for i in range(50)], ["aaa", "zzz"])
+
+    def test_not_located(self) -> None:
+        # Parsed in this process, there's nothing for the workers to open
+        folder = ig.InstagramDir(write_export(self.root, "acme", "2026-10-01", ["ann"], ["ann"]))
+        cache = ParseCache()
+        self.caches.append(cache)
+        self.assertIsNone(parallel_rows(self.pool, WORKERS, cache.get(folder, ig.Target.FOLLOWERS), cache.get(folder, ig.Target.FOLLOWING), Method.XA))
+
+if __name__ == "__main__":
+    unittest.main()
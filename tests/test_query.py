@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import re
+import random
+import shutil
+import tempfile
+import unittest
+
+import modules.ig as ig
+
+from modules.cache import ParseCache
+from modules.query import Parser, Operand, Expr, QueryEngine, InvalidQuery, Leaf, And, Diff, TOKEN
+from tests.test_server import write_export
+
+def show(node: Operand | Expr) -> str:
+    if isinstance(node, Operand):
+        return node.spec
+    return "(" + f" {node.op} ".join(show(arg) for arg in node.args) + ")"
+
+class ParserTest(unittest.TestCase):
+
+    def test_precedence(self) -> None:
+        # '-' before '&' before '|', left to right within each
+        self.assertEqual(show(Parser("a@1.followers | b@1.followers & c@1.followers - d@1.followers").parse()), "(a@1 | (b@1 & (c@1 - d@1)))")
+        self.assertEqual(show(Parser("a@1.followers - b@1.followers - c@1.following").parse()), "((a@1 - b@1) - c@1)")
+        self.assertEqual(show(Parser("(a@1.followers | b@1.followers) & c@1.followers").parse()), "((a@1 | b@1) & c@1)")
+
+    def test_operands(self) -> None:
+        node = Parser(" acme.co@2026-09#x1.following ").parse()
+        assert isinstance(node, Operand)
+        self.assertEqual((node.spec, node.target), ("acme.co@2026-09#x1", ig.Target.FOLLOWING))
+
+    def test_errors(self) -> None:
+        for text in ("", "   ", "a@1.followers |", "(a@1.followers", "a@1.followers)", "& a@1.followers", "a@1.followers b@1.followers", "a@1.friends", "a.followers"):
+            with self.assertRaises(InvalidQuery, msg = text):
+                Parser(text).parse()
+
+# Plans are checked against Python's own set operators, which have the same precedence as the queries
+class QueryEngineTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+
+        rng = random.Random(11)
+        everyone = [f"user{i:03d}" for i in range(120)]
+        self.root = tempfile.mkdtemp()
+        self.sets: dict[str, set[str]] = {}
+
+        for username, date in (("acme", "2026-09-01"), ("acme", "2026-10-01"), ("rival", "2026-10-01")):
+            followers, following = rng.sample(everyone, rng.randint(0, 80)), rng.sample(everyone, rng.randint(0, 80))
+            write_export(self.root, username, date, followers, following)
+            self.sets[f"{username}@{date[:7]}.followers"] = set(followers)
+            self.sets[f"{username}@{date[:7]}.following"] = set(following)
+
+        self.dirs = [folder for folder in ig.validate_many([self.root]) if isinstance(folder, ig.InstagramDir)]
+        self.cache = ParseCache()
+        self.engine = QueryEngine(self.cache)
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        shutil.rmtree(self.root, ignore_errors = True)
+
+    def naive(self, text: str) -> list[str]:
+        names = {f"x{i}": self.sets[operand] for i, operand in enumerate(self.sets)}
+        aliases = {operand: name for name, operand in zip(names, self.sets)}
+        return sorted(eval(TOKEN.sub(lambda match: f" {aliases[match.group('operand')]} " if match.group("operand") else f" {match.group('op')} ", text), {}, names))
+
+    def test_against_sets(self) -> None:
+
+        rng = random.Random(5)
+        operands = list(self.sets)
+
+        def expression(depth: int) -> str:
+            if depth == 0 or rng.random() < 0.3:
+                return rng.choice(operands)
+            left, right = expression(depth - 1), expression(depth - 1)
+            text = f"{left} {rng.choice('-&|')} {right}"
+            return f"({text})" if rng.random() < 0.5 else text
+
+        for _ in range(200):
+            text = expression(4)
+            result = self.engine.run(text, self.dirs)
+            self.assertEqual(list(result), self.naive(text), text)
+            self.assertEqual([result.url(k) for k in range(len(result))], [f"https://www.instagram.com/{username}" for username in result])
+            result.release()
+
+    def test_plan(self) -> None:
+
+        # (X - Y) & Z is planned as (X & Z) - Y, intersections smallest first
+        plan = self.engine.plan("(acme@2026-09.followers - acme@2026-10.followers) & rival@2026-10.following", self.dirs)
+        assert isinstance(plan, Diff) and isinstance(plan.base, And)
+        self.assertEqual([leaf.estimate for leaf in plan.base.children], sorted(leaf.estimate for leaf in plan.base.children))
+        self.assertEqual(plan.subtrahends[0].explain(), "acme@2026-10-01.followers")
+        self.assertTrue(all(isinstance(leaf, Leaf) for leaf in plan.leaves()))
+
+        # The same sets in another order are the same result
+        first = self.engine.plan("acme@2026-09.followers & rival@2026-10.following", self.dirs)
+        second = self.engine.plan("rival@2026-10.following & acme@2026-09.followers", self.dirs)
+        self.assertEqual(first.key, second.key)
+
+    def test_unknown_folder(self) -> None:
+        with self.assertRaises(ig.DirNotFound):
+            self.engine.run("acme@2026-09.followers - nobody@2026.followers", self.dirs)
+        with self.assertRaises(ig.DirNotFound):
+            self.engine.run("acme@2026.followers", self.dirs)
+
+if __name__ == "__main__":
+    unittest.main()
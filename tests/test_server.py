@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import http.client
+
+import modules.ig as ig
+
+from modules.cache import ParseCache
+from modules.index import UserIndex
+from modules.server import QueryService, QueryServer, STREAM_CHUNK_ROWS
+
+def write_export(root: str, username: str, date: str, followers: list[str], following: list[str]) -> str:
+
+    path = os.path.join(root, f"instagram-{username}-{date}-test")
+    connections = os.path.join(path, "connections", "followers_and_following")
+    os.makedirs(connections)
+
+    def page(users: list[str]) -> str:
+        entries = "".join(f'<div><a href="https://www.instagram.com/{user}">{user}</a><div>Sep 01, 2026 10:00 am</div></div>' for user in users)
+        return f"<html><body><main>{entries}</main></body></html>"
+
+    with open(os.path.join(connections, "followers_1.html"), "w", encoding = "utf-8") as f:
+        f.write(page(followers))
+    with open(os.path.join(connections, "following.html"), "w", encoding = "utf-8") as f:
+        f.write(page(following))
+
+    return path
+
+# Everything goes through a real socket on localhost, nothing leaves the machine
+class QueryServerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+
+        self.root = tempfile.mkdtemp()
+        many = [f"user{i:05d}" for i in range(STREAM_CHUNK_ROWS + 10)]
+        write_export(self.root, "acme", "2026-09-01", ["ann", "bob", "cat"] + many, ["ann"])
+        write_export(self.root, "acme", "2026-10-01", ["ann", "cat", "dan"], ["ann", "bob"])
+
+        self.dirs = [folder for folder in ig.validate_many([self.root]) if isinstance(folder, ig.InstagramDir)]
+        index = UserIndex()
+        self.cache = ParseCache(index.add)
+        self.server = QueryServer(QueryService(lambda: self.dirs, self.cache, index))
+        self.port = self.server.start_in_background()
+
+    def tearDown(self) -> None:
+        self.server.stop_in_background()
+        self.cache.close()
+        shutil.rmtree(self.root, ignore_errors = True)
+
+    def get(self, path: str, host: str | None = None) -> tuple[int, dict]:
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout = 10)
+        try:
+            connection.request("GET", path, headers = {"Host": f"127.0.0.1:{self.port}" if host is None else host})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_dirs(self) -> None:
+        status, body = self.get("/dirs")
+        self.assertEqual(status, 200)
+        self.assertEqual([(folder["date"], folder["following"]) for folder in body["dirs"]], [("2026-09-01", 1), ("2026-10-01", 2)])
+
+    def test_compare(self) -> None:
+        status, body = self.get("/compare?a=acme@2026-10&b=acme@2026-09&target=followers&method=xa&limit=2")
+        self.assertEqual(status, 200)
+        self.assertEqual(body["count"], STREAM_CHUNK_ROWS + 11)
+        self.assertEqual([user["username"] for user in body["users"]], ["bob", "user00000"])
+
+    def test_streamed(self) -> None:
+        status, body = self.get("/compare?a=acme@2026-09&b=acme@2026-10&method=ax")
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body["users"]), body["count"])
+        self.assertEqual(body["users"][-1]["url"], f"https://www.instagram.com/user{STREAM_CHUNK_ROWS + 9:05d}")
+
+    def test_followed(self) -> None:
+        status, body = self.get("/changes?account=acme&from=2026-09-01&to=2026-09-01&kind=followed")
+        self.assertEqual(status, 200)
+        self.assertEqual(body["in"]["date"], "2026-10-01")
+        self.assertEqual(sorted(user["username"] for user in body["users"]), ["ann", "cat", "dan"])
+        self.assertEqual(self.get("/changes?account=acme&from=2026-10-01&to=2026-12-31&kind=followed")[1]["count"], 0)
+        self.assertEqual(self.get("/changes?account=nobody&from=2026-01-01&to=2026-12-31&kind=followed")[0], 404)
+
+    def test_hosts(self) -> None:
+        self.assertEqual(self.get("/dirs", f"localhost:{self.port}")[0], 200)
+        self.assertEqual(self.get("/dirs", "[::1]")[0], 200)
+        self.assertEqual(self.get("/dirs", f"[::1]:{self.port}")[0], 200)
+        self.assertEqual(self.get("/dirs", f"example.com:{self.port}")[0], 403)
+        self.assertEqual(self.get("/dirs", "[::1]example.com")[0], 403)
+
+    def test_errors(self) -> None:
+        self.assertEqual(self.get("/compare?a=nobody@2026")[0], 404)
+        self.assertEqual(self.get("/compare?a=acme@2026-09&method=nope")[0], 400)
+        self.assertEqual(self.get("/nowhere")[0], 404)
+
+        # Removed after validating, the parse fails and the error still gets an answer
+        shutil.rmtree(self.dirs[0].path)
+        status, body = self.get("/compare?a=acme@2026-09")
+        self.assertIn(status, (404, 410))
+        self.assertIn("error", body)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import random
+import unittest
+
+from array import array
+from modules.ig import Connections
+from modules.views import DiffView, Method, Relation, Relations
+
+def connections(usernames: set[str]) -> Connections:
+    return Connections({username: f"https://www.instagram.com/{username}" for username in usernames}, {})
+
+# Every view is checked against the same sets computed naively, on lists spanning many front coded blocks
+class DiffViewTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        rng = random.Random(7)
+        everyone = [f"user{i:04d}" + "x" * rng.randint(0, 3) for i in range(400)]
+        self.a = set(rng.sample(everyone, 250))
+        self.b = set(rng.sample(everyone, 180))
+
+    def expected(self, method: Method) -> list[str]:
+        assert len(Method) == 3
+        if method == Method.XA:
+            return sorted(self.b - self.a)
+        if method == Method.AX:
+            return sorted(self.a - self.b)
+        return sorted(self.a & self.b)
+
+    def view(self, method: Method) -> DiffView:
+        return DiffView(connections(self.a), connections(self.b), method)
+
+    def test_len(self) -> None:
+        for method in Method:
+            # Counted without merging, then once everything is merged
+            view = self.view(method)
+            self.assertEqual(len(view), len(self.expected(method)), method)
+            view.fill(10**9)
+            view._count = None
+            self.assertEqual(len(view), len(self.expected(method)), method)
+
+    def test_indexing(self) -> None:
+        for method in Method:
+            expected = self.expected(method)
+            view = self.view(method)
+            for k in (-1, -len(expected), 0, 5, len(expected) - 1, -7):
+                self.assertEqual(view[k], expected[k], (method, k))
+                self.assertEqual(view.url(k), f"https://www.instagram.com/{expected[k]}")
+            with self.assertRaises(IndexError):
+                view[len(expected)]
+            with self.assertRaises(IndexError):
+                view[-len(expected) - 1]
+
+    def test_slicing(self) -> None:
+        for method in Method:
+            expected = self.expected(method)
+            for k in (slice(0, 10), slice(-10, None), slice(3, -3, 4), slice(None, None, -1), slice(-5, 2, -2), slice(50, 10**6), slice(10**6, None)):
+                self.assertEqual(self.view(method)[k], expected[k], (method, k))
+            self.assertEqual(list(self.view(method)), expected)
+
+    def test_ordered(self) -> None:
+        for method in Method:
+            view = self.view(method)
+            walker = sorted(self.b if method != Method.AX else self.a)
+            permutation = array('I', reversed(range(len(walker))))
+            ordered = view.ordered("reversed", permutation)
+            self.assertEqual(list(ordered), self.expected(method)[::-1])
+            self.assertIs(view.ordered("reversed", permutation), ordered)
+
+    def test_relations(self) -> None:
+        followers, following, other = set(list(self.a)[::2]), set(list(self.b)[::3]), set(list(self.a)[::5])
+        for method, lookahead in zip(list(Method) * 2, [Relations.LOOKAHEAD] * len(Method) + [4] * len(Method)):
+            view = self.view(method)
+            relations = view.relations(connections(followers), connections(following), [connections(other)])
+            relations.LOOKAHEAD = lookahead
+            expected = self.expected(method)
+            # Read out of order, jumping past what was flagged so far
+            for k in [len(expected) - 1, 0, len(expected) // 2] + list(range(len(expected))):
+                username = expected[k]
+                flags = (Relation.FOLLOWS_YOU if username in followers else 0) | (Relation.YOU_FOLLOW if username in following else 0) | (Relation.IN_OTHER if username in other else 0)
+                self.assertEqual(relations[k], flags, (method, username))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from unittest import mock
+
+import modules.ig as ig
+
+from modules.watcher import extract_zip
+
+class ExtractZipTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.patch = mock.patch("modules.watcher.cache_dir", lambda: os.path.join(self.root, "cache"))
+        self.patch.start()
+
+    def tearDown(self) -> None:
+        self.patch.stop()
+        shutil.rmtree(self.root, ignore_errors = True)
+
+    def write_zip(self, members: dict[str, str]) -> str:
+        path = os.path.join(self.root, "instagram-acme-2026-10-01-test.zip")
+        with zipfile.ZipFile(path, "w") as archive:
+            for name, text in members.items():
+                archive.writestr(name, text)
+        return path
+
+    def test_only_connections_inside(self) -> None:
+        prefix = "export/connections/followers_and_following/"
+        outdir = extract_zip(self.write_zip({
+            prefix + "following.html": "ok",
+            prefix + "../escaped.html": "no",
+            prefix + "sub/../../escaped.html": "no",
+            prefix + "/abs.html": "no",
+            "export/messages/inbox.html": "no",
+        }))
+        extracted = [os.path.relpath(os.path.join(dirpath, name), outdir) for dirpath, _, names in os.walk(os.path.join(self.root, "cache")) for name in names]
+        self.assertEqual(extracted, [os.path.join("connections", "followers_and_following", "following.html")])
+
+    def test_reextract_replaces(self) -> None:
+        prefix = "export/connections/followers_and_following/"
+        extract_zip(self.write_zip({prefix + "followers_1.html": "old", prefix + "followers_2.html": "old"}))
+        outdir = extract_zip(self.write_zip({prefix + "followers_1.html": "new"}))
+        self.assertEqual(os.listdir(os.path.join(outdir, "connections", "followers_and_following")), ["followers_1.html"])
+
+class FeedFromTest(unittest.TestCase):
+
+    def test_undecodable_is_invalid(self) -> None:
+        root = tempfile.mkdtemp()
+        try:
+            connections = os.path.join(root, "connections", "followers_and_following")
+            os.makedirs(connections)
+            with open(os.path.join(connections, "following.html"), "wb") as f:
+                f.write(b"\xff\xfe\xfa not text")
+            with mock.patch("modules.ig.file_get_contents", side_effect = UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")):
+                with self.assertRaises(ig.InvalidInstagramDir):
+                    ig.feed_from(root, ig.Target.FOLLOWING)
+        finally:
+            shutil.rmtree(root, ignore_errors = True)
+
+if __name__ == "__main__":
+    unittest.main()